@@ -0,0 +1,515 @@
+import atexit
+import cairosvg
+import io
+import json
+import logging
+from flask import Flask, Response, request, jsonify, send_file, g
+import os
+import shutil
+import tempfile
+import time
+from model_loader import PROCESS_START
+from latex_plugin import latex, pdf_cache, figure_cache, latex_pool
+from latex_pool import LatexPoolFull
+import ocr_model
+import ocr_engine
+from ocr_model import ocr_images, batcher, loader as ocr_loader
+from ocr_cache import OCRCache, cache_key
+from ocr_session import OCRSessions
+from ocr_jobs import JobQueue, JobQueueFull
+import sentiment_plugin
+from sentiment_plugin import sentiment, sentiment_chunked, DEFAULT_BATCH_SIZE, loader as sentiment_loader
+from render import create_svg_string, png_to_image, rasterize
+from metrics import registry, span, model_memory_bytes, process_memory_bytes
+from stack_sampler import StackSampler, collapsed
+from stroke_format import CONTENT_TYPE as STROKES_CONTENT_TYPE, StrokeFormatError, decode as decode_strokes
+from simplify import StrokeSimplifier
+from document_store import DocumentStore
+from layout import LineSegmenter
+
+# draw a page into an RGB image, going through svg and png only for path
+# data the direct rasterizer doesn't handle
+def render_page(paths, viewbox):
+    try:
+        with span("rasterize"):
+            return rasterize(paths, viewbox)
+    except ValueError as e:
+        logging.info(f"Falling back to SVG rendering: {e}")
+    with span("svg_build"):
+        svg_string = create_svg_string(paths, viewbox)
+    with span("svg_rasterize"):
+        return png_to_image(cairosvg.svg2png(bytestring=svg_string.encode('utf-8')))
+
+def read_json():
+    with span("json_parse"):
+        return request.get_json()
+
+# body of a page upload, json or the packed stroke format. packed pages are
+# returned in the json shape, their strokes under page_key along with the
+# other fields from the stroke data's metadata. either way the strokes come
+# back simplified
+def read_page_request(page_key=None):
+    if request.mimetype == STROKES_CONTENT_TYPE:
+        try:
+            with span("stroke_decode"):
+                paths, viewbox, meta = decode_strokes(request.get_data(cache=False))
+        except StrokeFormatError as e:
+            raise ProcessingError(f"Invalid stroke data: {e}", 400)
+        page = {"svgPaths": paths, "viewbox": viewbox}
+        data = {**meta, page_key: page} if page_key else {**meta, **page}
+    elif not request.is_json:
+        raise ProcessingError(f"Request must be JSON or {STROKES_CONTENT_TYPE}", 400)
+    else:
+        data = read_json()
+
+    page = data.get(page_key) if page_key and isinstance(data, dict) else data
+    if isinstance(page, dict) and 'svgPaths' in page:
+        with span("simplify"):
+            page['svgPaths'] = stroke_simplifier.simplify(page['svgPaths'])
+    return data
+
+# what the model sees of a page: the whole page, or on tall pages one image
+# per block of text lines at their drawn size. returns the images and the
+# blocks, None for a whole page. image is the page's raster if it has one
+def page_images(paths, viewbox, image=None):
+    with span("layout"):
+        blocks = line_segmenter.blocks(paths, viewbox)
+    if blocks is None:
+        return [image if image is not None else render_page(paths, viewbox)], None
+    return [render_page(block_paths, block_viewbox) for block_paths, block_viewbox in blocks], blocks
+
+# the page's ocr results from those of its images
+def page_results(blocks, viewbox, results):
+    return results[0] if blocks is None else line_segmenter.merge(blocks, viewbox, results)
+
+# render each (paths, viewbox) page and ocr them together
+def ocr_pages(pages):
+    planned = []
+    images = []
+    for paths, viewbox in pages:
+        page, blocks = page_images(paths, viewbox)
+        planned.append((blocks, viewbox, len(page)))
+        images.extend(page)
+    results = ocr_images(images)
+    merged = []
+    start = 0
+    for blocks, viewbox, count in planned:
+        merged.append(page_results(blocks, viewbox, results[start:start + count]))
+        start += count
+    return merged
+
+class ProcessingError(Exception):
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+def model_unavailable(loader):
+    if loader.state == "failed":
+        return ProcessingError(f"The {loader.name} model failed to load: {loader.error}", 503)
+    return ProcessingError(f"The {loader.name} model is still loading, try again shortly", 503)
+
+# cache lookup, rendering and ocr of one page, shared by /process_svg and the
+# job queue. progress is called with the name of each stage before it starts.
+# returns the page's document id along with the ocr results, the page is kept
+# in the document store under it for the plugins
+def process_page(svg_paths, viewbox, session_id=None, progress=lambda stage: None):
+    # skip rendering and ocr entirely if this exact page was seen before
+    progress("cache")
+    try:
+        key = cache_key(svg_paths, viewbox)
+    except Exception as e:
+        logging.exception("Error hashing SVG paths")
+        raise ProcessingError(f"Invalid 'svgPaths' or 'viewbox': {e}", 400)
+    cached_results = ocr_cache.get(key)
+    if cached_results is not None:
+        if session_id:
+            ocr_sessions.update(session_id, svg_paths, viewbox, cached_results)
+        documents.put(key, svg_paths, viewbox, cached_results)
+        return key, cached_results
+
+    if not ocr_loader.ready:
+        raise model_unavailable(ocr_loader)
+
+    # only re-recognize what changed since this document's last sync
+    if session_id:
+        progress("ocr")
+        try:
+            ocr_results = ocr_sessions.ocr(session_id, svg_paths, viewbox)
+        except Exception as e:
+            logging.exception("Failed to OCR")
+            raise ProcessingError(f"Failed to do OCR: {e}")
+        # stitched from regions, so not what a full page ocr would give. the
+        # cache only holds full page results
+        documents.put(key, svg_paths, viewbox, ocr_results)
+        return key, ocr_results
+
+    # draw the page straight into an image for ocr, unless it is still stored
+    progress("render")
+    try:
+        images, blocks = page_images(svg_paths, viewbox, documents.image(key))
+    except Exception as e:
+        logging.exception("Error rendering page")
+        raise ProcessingError(f"Failed to render page: {e}")
+
+    # Perform OCR, the blocks of a tall page go to the model together
+    progress("ocr")
+    try:
+        ocr_results = page_results(blocks, viewbox, ocr_images(images))
+    except Exception as e:
+        logging.exception("Failed to OCR")
+        raise ProcessingError(f"Failed to do OCR: {e}")
+    ocr_cache.put(key, ocr_results)
+    documents.put(key, svg_paths, viewbox, ocr_results, images[0] if blocks is None else None)
+    return key, ocr_results
+
+def run_ocr_job(payload, progress):
+    document_id, ocr_results = process_page(*payload, progress=progress)
+    return {"ocr_results": ocr_results, "document_id": document_id}
+
+# Flask Application
+app = Flask(__name__)
+logging.basicConfig(level=logging.INFO) # Set logging level
+
+# repeated syncs of an unchanged page are answered from this cache
+ocr_cache = OCRCache(
+    max_entries=int(os.environ.get("OCR_CACHE_MAX_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    cache_dir=os.environ.get("OCR_CACHE_DIR") or None,
+)
+
+# nearly collinear pen points are dropped before anything else sees the page,
+# tolerance is in page pixels and 0 turns it off
+stroke_simplifier = StrokeSimplifier(tolerance=float(os.environ.get("STROKE_SIMPLIFY_TOLERANCE", 0.5)))
+
+# pages the plugins can refer to by the document id /process_svg returned.
+# least recently used ones spill to DOCUMENT_STORE_DIR past the memory budget,
+# or to a private temporary directory that goes away with the server
+document_dir = os.environ.get("DOCUMENT_STORE_DIR")
+if not document_dir:
+    document_dir = tempfile.mkdtemp(prefix="smartpen-documents-")
+    atexit.register(shutil.rmtree, document_dir, True)
+documents = DocumentStore(
+    max_bytes=int(os.environ.get("DOCUMENT_STORE_MAX_BYTES", 256 * 1024 * 1024)),
+    spill_dir=document_dir,
+    max_spill_bytes=int(os.environ.get("DOCUMENT_STORE_MAX_DISK_BYTES", 2 * 1024 * 1024 * 1024)),
+)
+
+# tall pages are ocr'd a few lines at a time instead of shrunk to the model's
+# input size. OCR_SEGMENT_MIN_HEIGHT=0 always sends the whole page
+line_segmenter = LineSegmenter(
+    min_page_height=float(os.environ.get("OCR_SEGMENT_MIN_HEIGHT", 1024)),
+    max_block_height=float(os.environ.get("OCR_SEGMENT_BLOCK_HEIGHT", 256)),
+)
+
+# documents that send a 'sessionId' only get their changed regions ocr'd again
+ocr_sessions = OCRSessions(ocr_pages, max_sessions=int(os.environ.get("OCR_MAX_SESSIONS", 128)))
+
+# background ocr jobs for clients that can't hold a request open for a full run
+ocr_jobs = JobQueue(
+    run_ocr_job,
+    workers=int(os.environ.get("OCR_JOB_WORKERS", 4)),
+    max_queued=int(os.environ.get("OCR_JOB_QUEUE_SIZE", 64)),
+    ttl=float(os.environ.get("OCR_JOB_TTL", 300)),
+)
+
+# request, queue and memory metrics for /metrics, stage timings come from the span() calls
+requests_in_flight = registry.gauge("smartpen_requests_in_flight", "Requests currently being handled")
+request_seconds = registry.histogram("smartpen_request_seconds", "Time to handle a request", ["endpoint", "method"])
+requests_total = registry.counter("smartpen_requests_total", "Requests handled", ["endpoint", "method", "status"])
+registry.gauge("smartpen_queue_depth", "Work waiting in each queue", ["queue"], lambda: {
+    ("ocr_batch",): batcher.requests.qsize(),
+    ("ocr_workers",): ocr_model.pool.stats()["pending_batches"] if ocr_model.pool else 0,
+    ("ocr_jobs",): ocr_jobs.stats()["queued"],
+    ("latex",): latex_pool.stats()["pending"],
+})
+registry.gauge("smartpen_ocr_jobs_running", "OCR jobs being worked on", callback=lambda: ocr_jobs.stats()["running"])
+registry.gauge("smartpen_model_memory_bytes", "Memory held by each model's weights", ["model"], lambda: {
+    ("ocr",): model_memory_bytes(ocr_engine.model),
+    ("sentiment",): model_memory_bytes(getattr(sentiment_plugin.distilled_student_sentiment_classifier, "model", None)),
+})
+registry.gauge("smartpen_model_ready", "1 once a model is loaded", ["model"], lambda: {
+    ("ocr",): int(ocr_loader.ready),
+    ("sentiment",): int(sentiment_loader.ready),
+})
+registry.gauge("smartpen_process_resident_bytes", "Resident memory of the server process", callback=process_memory_bytes)
+registry.gauge("smartpen_stroke_points", "Stroke points received and left after simplification", ["stage"], lambda: {
+    ("received",): stroke_simplifier.stats()["points_in"],
+    ("simplified",): stroke_simplifier.stats()["points_out"],
+})
+registry.gauge("smartpen_cache_bytes", "Size of each result cache", ["cache"], lambda: {
+    ("ocr",): ocr_cache.stats()["bytes"],
+    ("pdf",): pdf_cache.stats()["bytes"],
+    ("latex_figures",): figure_cache.stats()["bytes"],
+    ("documents",): documents.stats()["bytes"],
+})
+
+# sampling profiler behind /debug/profile, off unless PROFILER_ENABLED is set
+stack_sampler = StackSampler() if os.environ.get("PROFILER_ENABLED") else None
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    requests_in_flight.inc()
+
+@app.after_request
+def record_request(response):
+    # url_rule keeps the label set small, unknown paths are grouped together
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    request_seconds.observe(time.perf_counter() - g.request_start, endpoint=endpoint, method=request.method)
+    requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request(error=None):
+    requests_in_flight.dec()
+
+# endpoint to process the svg and plugins
+@app.route('/process_svg', methods=['POST'])
+def process_ocr_request():
+    try:
+        data = read_page_request()
+    except ProcessingError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    # Basic Input Validation
+    if not data or 'svgPaths' not in data or 'viewbox' not in data:
+        return jsonify({"error": "Missing 'svgPaths' or 'viewbox' or 'ocrData' in JSON input"}), 400
+
+    svg_paths = data.get('svgPaths', [])
+    viewbox = data.get('viewbox', {})
+    session_id = data.get('sessionId')
+
+    try:
+        document_id, ocr_results = process_page(svg_paths, viewbox, session_id)
+    except ProcessingError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    # Return ocr results, plugins can pass document_id instead of the page
+    final_response = {
+        "ocr_results": ocr_results,
+        "document_id": document_id,
+    }
+    logging.debug(final_response)
+    return jsonify(final_response)
+
+# same input as /process_svg, but returns a job id straight away
+@app.route('/ocr_jobs', methods=['POST'])
+def submit_ocr_job():
+    try:
+        data = read_page_request()
+    except ProcessingError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    # Basic Input Validation
+    if not data or 'svgPaths' not in data or 'viewbox' not in data:
+        return jsonify({"error": "Missing 'svgPaths' or 'viewbox' in JSON input"}), 400
+
+    try:
+        job = ocr_jobs.submit((data.get('svgPaths', []), data.get('viewbox', {}), data.get('sessionId')))
+    except JobQueueFull as e:
+        return jsonify({"error": f"{e}, try again shortly"}), 503
+    return jsonify({"job_id": job.id}), 202
+
+@app.route('/ocr_jobs/<job_id>', methods=['GET'])
+def get_ocr_job(job_id):
+    job = ocr_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.status())
+
+@app.route('/ocr_jobs/<job_id>', methods=['DELETE'])
+def cancel_ocr_job(job_id):
+    job = ocr_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.status())
+
+# server sent events with the job status every time it changes, ends when the job does
+@app.route('/ocr_jobs/<job_id>/events', methods=['GET'])
+def stream_ocr_job(job_id):
+    job = ocr_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def events():
+        version = None
+        while True:
+            new_version = job.wait_for_change(version, timeout=15)
+            if new_version == version:
+                # comment line keeps idle connections open
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            yield f"data: {json.dumps(job.status())}\n\n"
+            if job.finished:
+                return
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/latex_plugin', methods=['POST'])
+def get_latex():
+    try:
+        data = read_page_request('svg_paths')
+    except ProcessingError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    # a 'document_id' from /process_svg stands in for the strokes and ocr
+    # results, either can still be sent along (the app lets users edit the ocr text)
+    if isinstance(data, dict) and data.get('document_id'):
+        document = documents.get(data['document_id'])
+        if document is None:
+            return jsonify({"error": "Unknown 'document_id', process the page again"}), 404
+        data.setdefault('svg_paths', {"svgPaths": document["svgPaths"], "viewbox": document["viewbox"]})
+        data.setdefault('ocrData', document["ocr_results"])
+        data.setdefault('options', [])
+
+    # Basic Input Validation
+    if 'options' not in data or 'ocrData' not in data or 'svg_paths' not in data:
+        return jsonify({"error": "Missing 'options' or 'ocrData' or 'svg_paths' in JSON input"}), 400
+
+    options = data.get('options', [])
+    ocrData = data.get('ocrData', {})
+    svg_paths = data.get('svg_paths', [])
+    
+    if len(ocrData) == 0 or len(svg_paths) == 0:
+        return jsonify({"error": "Missing attributes in 'ocrData' or 'svg_paths' empty"}), 400
+
+    try:
+        result = latex(ocrData, options, svg_paths=svg_paths)
+    except LatexPoolFull:
+        return jsonify({"error": "Too many LaTeX exports in progress, try again"}), 503
+
+    if result is None:
+        logging.error("LaTeX compile produced no PDF")
+        return jsonify({"error": f"Error returning file back"}), 500
+
+    # Return pdf back to user
+    return send_file(
+        io.BytesIO(result),
+        as_attachment=True,
+        download_name='output.pdf',
+        mimetype='application/pdf'
+    )
+
+@app.route('/sentiment_plugin', methods=['POST'])
+def get_sentiment():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    data = read_json()
+
+    # the text of a page /process_svg already recognized
+    if isinstance(data, dict) and data.get('document_id') and 'sentimentData' not in data:
+        document = documents.get(data['document_id'])
+        if document is None:
+            return jsonify({"error": "Unknown 'document_id', process the page again"}), 404
+        data['sentimentData'] = "\n".join(document["ocr_results"].get("labels", [])).replace("</s>", "")
+
+    # Basic Input Validation
+    if 'sentimentData' not in data:
+        return jsonify({"error": "Missing 'options' or 'sentimentData' in JSON input"}), 400
+
+    options = data.get('options', [])
+    sentimentData = data.get('sentimentData', '')
+
+    if not sentiment_loader.ready:
+        error = model_unavailable(sentiment_loader)
+        return jsonify({"error": str(error)}), error.status
+
+    # long documents are split into token bounded chunks and batched, the
+    # aggregate keeps the same shape as a single call's result
+    if data.get('chunked'):
+        try:
+            batch_size = int(data.get('batchSize', DEFAULT_BATCH_SIZE))
+            # left out, chunks are as long as the model takes
+            max_tokens = int(data['maxTokens']) if data.get('maxTokens') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "'batchSize' and 'maxTokens' must be integers"}), 400
+        if batch_size < 1 or (max_tokens is not None and max_tokens < 1):
+            return jsonify({"error": "'batchSize' and 'maxTokens' must be at least 1"}), 400
+        result = sentiment_chunked(sentimentData, batch_size=batch_size, max_tokens=max_tokens)
+        return jsonify({
+            "sentiment_results": [result["aggregate"]],
+            "sentiment_chunks": result["chunks"],
+        })
+
+    result = sentiment(sentimentData);
+
+    # Return ocr results
+    final_response = {
+        "sentiment_results": result,
+    }
+    return jsonify(final_response)
+
+# batch size and latency of the ocr batcher, used to tune the batching window,
+# plus the state and load of each worker process when OCR_WORKERS is set and
+# how many tall pages were split into blocks of lines
+@app.route('/ocr_stats', methods=['GET'])
+def get_ocr_stats():
+    stats = batcher.stats()
+    if ocr_model.pool:
+        stats["pool"] = ocr_model.pool.stats()
+    stats["layout"] = line_segmenter.stats()
+    return jsonify(stats)
+
+# hit/miss counters and size of the ocr result cache
+@app.route('/ocr_cache_stats', methods=['GET'])
+def get_ocr_cache_stats():
+    return jsonify(ocr_cache.stats())
+
+# how many stroke points simplification has removed so far
+@app.route('/simplify_stats', methods=['GET'])
+def get_simplify_stats():
+    return jsonify(stroke_simplifier.stats())
+
+# documents held for the plugins, in memory and spilled to disk
+@app.route('/document_stats', methods=['GET'])
+def get_document_stats():
+    return jsonify(documents.stats())
+
+# hit/miss counters and size of the compiled pdf cache and the figure cache
+@app.route('/latex_cache_stats', methods=['GET'])
+def get_latex_cache_stats():
+    return jsonify({**pdf_cache.stats(), "figures": figure_cache.stats()})
+
+# prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# samples every thread's stack for a few seconds and returns them in collapsed
+# form for flamegraph.pl or speedscope
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    if stack_sampler is None:
+        return jsonify({"error": "Profiler disabled, set PROFILER_ENABLED to turn it on"}), 404
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval_ms', 5)) / 1000.0
+    except ValueError:
+        return jsonify({"error": "'seconds' and 'interval_ms' must be numbers"}), 400
+    stacks = stack_sampler.sample(seconds, max(interval, 0.001))
+    if stacks is None:
+        return jsonify({"error": "A profile is already running"}), 409
+    return Response(collapsed(stacks), mimetype='text/plain')
+
+# load state of each model plus startup timings, 503 until every model is ready
+@app.route('/ready', methods=['GET'])
+def get_ready():
+    models = {
+        "ocr": ocr_loader.status(),
+        "sentiment": sentiment_loader.status(),
+    }
+    ready = ocr_loader.ready and sentiment_loader.ready
+    response = {
+        "ready": ready,
+        "import_seconds": import_seconds,
+        "models": models,
+    }
+    return jsonify(response), 200 if ready else 503
+
+# models load in parallel in the background, endpoints answer 503 until theirs is ready
+ocr_loader.start()
+sentiment_loader.start()
+import_seconds = time.perf_counter() - PROCESS_START
+logging.info(f"Server imported in {import_seconds:.2f}s, loading models in the background")
@@ -0,0 +1,60 @@
+# compares the per pair check_point loop against QuadGridIndex for sorting
+# paths into free drawing and text, and checks both give the same answer
+# run from the api directory: python -m benchmarks.classify_benchmark
+import argparse
+import random
+import time
+import numpy as np
+from latex_plugin import check_point
+from quad_index import QuadGridIndex
+
+# text line boxes laid out like ocr output plus path centers scattered over
+# the page, some of them inside text and some in the margins
+def synthetic_layout(paths, boxes, seed=0):
+    rng = random.Random(seed)
+    quad_boxes = []
+    for i in range(boxes):
+        x = rng.uniform(0, 1200)
+        y = (i % 200) * 60 + rng.uniform(0, 10)
+        w = rng.uniform(40, 400)
+        h = rng.uniform(25, 45)
+        quad_boxes.append([x, y, x + w, y, x + w, y + h, x, y + h])
+    centers = [(rng.uniform(0, 1700), rng.uniform(0, 12000)) for _ in range(paths)]
+    return centers, quad_boxes
+
+def classify_loop(centers, quad_boxes):
+    result = []
+    for centerX, centerY in centers:
+        found_in_quadbox = False
+        for bound in quad_boxes:
+            x1, y1, x2, y2, x3, y3, x4, y4 = bound
+            if check_point(centerX, centerY, x1, y1, x2, y2, x3, y3, x4, y4):
+                found_in_quadbox = True
+                break
+        result.append(found_in_quadbox)
+    return np.array(result, dtype=bool)
+
+def classify_index(centers, quad_boxes):
+    return QuadGridIndex(quad_boxes).contains(np.array(centers, dtype=np.float64))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=str, nargs="+", default=["100x20", "1000x100", "5000x500"],
+                        help="paths x boxes")
+    args = parser.parse_args()
+
+    print(f"{'paths':>6} {'boxes':>6} {'loop (ms)':>10} {'index (ms)':>11} {'speedup':>8} {'identical':>10}")
+    for size in args.sizes:
+        paths, boxes = (int(v) for v in size.split("x"))
+        centers, quad_boxes = synthetic_layout(paths, boxes)
+
+        start = time.perf_counter()
+        expected = classify_loop(centers, quad_boxes)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = classify_index(centers, quad_boxes)
+        index_time = time.perf_counter() - start
+
+        identical = bool(np.array_equal(expected, actual))
+        print(f"{paths:>6} {boxes:>6} {loop_time * 1000:>10.2f} {index_time * 1000:>11.2f} {loop_time / index_time:>7.1f}x {str(identical):>10}")
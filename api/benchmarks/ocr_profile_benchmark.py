@@ -0,0 +1,90 @@
+# accuracy against latency of each OCR inference profile on the same set of
+# generated pages with known text. run from the api directory:
+#   python -m benchmarks.ocr_profile_benchmark --profiles accurate quantized fast
+import argparse
+import json
+import random
+import time
+import ocr_engine
+from render import rasterize
+
+WORDS = ("the quick brown fox jumps over lazy dog notes pen paper smart lecture "
+         "meeting summary review draft chapter figure table index result method").split()
+
+# pages of typed text so the expected output is known exactly
+def synthetic_pages(count, lines=6, words_per_line=5, font_size=32, seed=0):
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(count):
+        paths = []
+        text_lines = []
+        for line in range(lines):
+            text = " ".join(rng.choice(WORDS) for _ in range(words_per_line))
+            text_lines.append(text)
+            paths.append({"type": "text", "data": text, "x": 0, "y": line * font_size * 2,
+                          "color": "black", "strokeSize": font_size})
+        # same 500 padding around the content the app adds
+        viewbox = {"minx": -500, "miny": -500, "width": 1000 + words_per_line * font_size * 6,
+                   "height": 1000 + lines * font_size * 2}
+        pages.append((rasterize(paths, viewbox), " ".join(text_lines)))
+    return pages
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def recognized_text(result):
+    text = " ".join(result.get("labels", []))
+    return " ".join(text.replace("</s>", " ").replace("<s>", " ").split())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", nargs="+", default=list(ocr_engine.PROFILES))
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.pages, seed=args.seed)
+    results = []
+    print(f"{'profile':>10} {'load (s)':>9} {'warmup (s)':>11} {'mean (s)':>9} {'CER':>7}")
+    for name in args.profiles:
+        ocr_engine.profile = ocr_engine.profile_settings(name)
+        start = time.perf_counter()
+        ocr_engine.load_model()
+        load_time = time.perf_counter() - start
+
+        # first call pays for compilation, keep it out of the mean
+        start = time.perf_counter()
+        ocr_engine.ocr_batch([pages[0][0]])
+        warmup_time = time.perf_counter() - start
+
+        times = []
+        errors = 0
+        characters = 0
+        for image, expected in pages:
+            start = time.perf_counter()
+            result = ocr_engine.ocr_batch([image])[0]
+            times.append(time.perf_counter() - start)
+            errors += edit_distance(recognized_text(result), expected)
+            characters += len(expected)
+
+        row = {
+            "profile": name,
+            "settings": ocr_engine.profile,
+            "load_seconds": load_time,
+            "warmup_seconds": warmup_time,
+            "mean_seconds": sum(times) / len(times),
+            "character_error_rate": errors / characters,
+        }
+        results.append(row)
+        print(f"{name:>10} {load_time:>9.1f} {warmup_time:>11.2f} {row['mean_seconds']:>9.2f} {row['character_error_rate']:>7.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"device": ocr_engine.device, "pages": args.pages, "seed": args.seed, "results": results}, f, indent=2)
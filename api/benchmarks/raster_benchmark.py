@@ -0,0 +1,35 @@
+# compares the svg -> png -> PIL route against drawing paths directly with cairo
+# run from the api directory: python -m benchmarks.raster_benchmark
+import argparse
+import time
+import cairosvg
+import numpy as np
+from render import create_svg_string, png_to_image, rasterize
+from benchmarks.synthetic import synthetic_page
+
+def svg_route(paths, viewbox):
+    svg_string = create_svg_string(paths, viewbox)
+    return png_to_image(cairosvg.svg2png(bytestring=svg_string.encode('utf-8')))
+
+def time_it(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, min(times), sum(times) / len(times)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--strokes", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'strokes':>8} {'svg+png (ms)':>14} {'direct (ms)':>12} {'speedup':>8} {'max diff':>9} {'mean diff':>10}")
+    for strokes in args.strokes:
+        payload, _ = synthetic_page(strokes)
+        paths, viewbox = payload["svgPaths"], payload["viewbox"]
+        svg_image, svg_best, _ = time_it(lambda: svg_route(paths, viewbox), args.repeat)
+        direct_image, direct_best, _ = time_it(lambda: rasterize(paths, viewbox), args.repeat)
+        diff = np.abs(np.asarray(svg_image, dtype=np.int16) - np.asarray(direct_image, dtype=np.int16))
+        print(f"{strokes:>8} {svg_best * 1000:>14.2f} {direct_best * 1000:>12.2f} {svg_best / direct_best:>7.2f}x {diff.max():>9} {diff.mean():>10.4f}")
@@ -0,0 +1,268 @@
+# times every stage of the /process_svg and /latex_plugin pipelines on its own
+# using synthetic pages, and writes the timings as json so releases can be
+# compared. the ocr stages use a stub unless --model is given, stages whose
+# dependencies (cairo, pdflatex, ...) are missing are reported as skipped.
+# run from the api directory:
+#   python -m benchmarks.stages --strokes 500 --json stages.json
+# pass --simplify-tolerance 0 to time the later stages on unsimplified strokes
+import argparse
+import json
+import platform
+import shutil
+import sys
+import time
+from benchmarks.synthetic import synthetic_page
+from stroke_format import decode as decode_strokes, encode as encode_strokes
+from simplify import StrokeSimplifier
+
+# florence's processor resizes every page to this square
+STUB_IMAGE_SIZE = 768
+STUB_MEAN = (0.485, 0.456, 0.406)
+STUB_STD = (0.229, 0.224, 0.225)
+
+LATEX_TEMPLATE = r"""\documentclass{article}
+\usepackage{graphicx}
+\begin{document}
+\begin{penContent}\end{penContent}
+\end{document}
+"""
+
+class Skip(Exception):
+    pass
+
+def time_stage(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "runs": repeat,
+        "mean_ms": sum(times) / len(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "max_ms": max(times) * 1000,
+    }
+
+# same resize and normalization the real image processor does, without the model download
+def stub_preprocess(image):
+    import numpy as np
+    from PIL import Image
+    resized = image.resize((STUB_IMAGE_SIZE, STUB_IMAGE_SIZE), Image.BICUBIC)
+    pixels = np.asarray(resized, dtype=np.float32) / 255.0
+    pixels = (pixels - np.array(STUB_MEAN, dtype=np.float32)) / np.array(STUB_STD, dtype=np.float32)
+    return pixels.transpose(2, 0, 1)[None]
+
+class Pipeline:
+    def __init__(self, payload, ocr_results, use_model, simplify_tolerance=0.5):
+        self.payload = payload
+        self.ocr_results = ocr_results
+        self.use_model = use_model
+        self.body = json.dumps(payload)
+        self.packed = encode_strokes(payload["svgPaths"], payload["viewbox"])
+        self.simplifier = StrokeSimplifier(simplify_tolerance)
+        # what the server hands to the stages after read_page_request
+        self.paths = self.simplifier.simplify(payload["svgPaths"])
+        self.point_stats = self.simplifier.stats()
+        self.svg_string = None
+        self.png = None
+        self.image = None
+        self.inputs = None
+        self.rendered = None
+        self.free_paths = None
+
+    def json_parse(self):
+        json.loads(self.body)
+
+    def stroke_decode(self):
+        decode_strokes(self.packed)
+
+    def simplify(self):
+        self.simplifier.simplify(self.payload["svgPaths"])
+
+    def create_svg_string(self):
+        from render import create_svg_string
+        self.svg_string = create_svg_string(self.paths, self.payload["viewbox"])
+
+    def svg2png(self):
+        import cairosvg
+        self.png = cairosvg.svg2png(bytestring=self.svg_string.encode("utf-8"))
+
+    def png_decode(self):
+        from render import png_to_image
+        if self.png is None:
+            raise Skip("needs svg2png")
+        self.image = png_to_image(self.png)
+
+    def layout(self):
+        from layout import LineSegmenter
+        LineSegmenter().blocks(self.paths, self.payload["viewbox"])
+
+    def rasterize(self):
+        from render import rasterize
+        self.image = rasterize(self.paths, self.payload["viewbox"])
+
+    def ocr_preprocess(self):
+        if self.image is None:
+            raise Skip("needs a rendered page")
+        if not self.use_model:
+            self.inputs = stub_preprocess(self.image)
+            return
+        import ocr_engine
+        self.inputs = ocr_engine.processor(text=['<OCR_WITH_REGION>'], images=[self.image],
+                                          return_tensors="pt").to(ocr_engine.device, ocr_engine.torch_dtype)
+
+    def ocr_generate(self):
+        if not self.use_model:
+            # stub answers with the layout the generator wrote
+            return self.ocr_results
+        import torch
+        import ocr_engine
+        if self.inputs is None:
+            raise Skip("needs ocr_preprocess")
+        with torch.no_grad():
+            ocr_engine.model.generate(
+                input_ids=self.inputs["input_ids"],
+                pixel_values=self.inputs["pixel_values"],
+                max_new_tokens=ocr_engine.profile["max_new_tokens"],
+                num_beams=ocr_engine.profile["num_beams"],
+                do_sample=False,
+            )
+
+    def _centers(self):
+        centers = []
+        for path in self.payload["svgPaths"]:
+            bounds = path["bounds"]
+            centers.append((bounds["x"] + 500 + bounds["width"] / 2.0, bounds["y"] + 500 + bounds["height"] / 2.0))
+        return centers
+
+    def check_point(self):
+        from latex_plugin import check_point
+        for center_x, center_y in self._centers():
+            for bound in self.ocr_results["quad_boxes"]:
+                if check_point(center_x, center_y, *bound):
+                    break
+
+    def quad_index(self):
+        import numpy as np
+        from quad_index import QuadGridIndex
+        QuadGridIndex(self.ocr_results["quad_boxes"]).contains(np.array(self._centers(), dtype=np.float64))
+
+    # the free drawing figure, as latex() builds it for includegraphics
+    def figure_pdf(self):
+        import numpy as np
+        from quad_index import QuadGridIndex
+        from render import render_pdf
+        if self.free_paths is None:
+            in_text = QuadGridIndex(self.ocr_results["quad_boxes"]).contains(np.array(self._centers(), dtype=np.float64))
+            self.free_paths = [path for path, text in zip(self.paths, in_text) if not text]
+        render_pdf(self.free_paths)
+
+    def mistletoe_render(self):
+        import mistletoe
+        from mistletoe.latex_renderer import LaTeXRenderer
+        text = "\n".join(self.ocr_results["labels"]).replace("</s>", "")
+        self.rendered = mistletoe.markdown(text, LaTeXRenderer)
+
+    def latex_compile(self):
+        import tempfile
+        from latex_pool import LatexJobPool
+        if shutil.which("pdflatex") is None:
+            raise Skip("pdflatex not installed")
+        if self.rendered is None:
+            raise Skip("needs mistletoe_render")
+        lines = [line for line in self.rendered.splitlines() if "usepackage" not in line and "lstlisting" not in line]
+        body = "\n".join(lines[2:-1])
+        tex = LATEX_TEMPLATE.replace(r"\begin{penContent}\end{penContent}", body)
+        with tempfile.TemporaryDirectory() as template_dir:
+            LatexJobPool(template_dir, max_workers=1).compile(tex)
+
+STAGES = [
+    "json_parse",
+    "stroke_decode",
+    "simplify",
+    "layout",
+    "create_svg_string",
+    "svg2png",
+    "png_decode",
+    "rasterize",
+    "ocr_preprocess",
+    "ocr_generate",
+    "check_point",
+    "quad_index",
+    "figure_pdf",
+    "mistletoe_render",
+    "latex_compile",
+]
+
+def run(args):
+    payload, ocr_results = synthetic_page(
+        strokes=args.strokes,
+        page_width=args.page_width,
+        page_height=args.page_height,
+        text_density=args.text_density,
+        seed=args.seed,
+    )
+
+    if args.model:
+        import ocr_engine
+        ocr_engine.load_model()
+
+    pipeline = Pipeline(payload, ocr_results, args.model, args.simplify_tolerance)
+    results = {}
+    for name in args.stages:
+        stage = getattr(pipeline, name)
+        try:
+            # one untimed run so imports and caches don't count
+            stage()
+            results[name] = time_stage(stage, args.repeat)
+        except (Skip, ImportError, OSError) as e:
+            results[name] = {"skipped": str(e).splitlines()[0] if str(e) else type(e).__name__}
+    return {
+        "config": {
+            "strokes": args.strokes,
+            "page_width": args.page_width,
+            "page_height": args.page_height,
+            "text_density": args.text_density,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "model": args.model,
+            "simplify_tolerance": args.simplify_tolerance,
+            "json_bytes": len(pipeline.body),
+            "packed_bytes": len(pipeline.packed),
+            "svg_bytes": len(pipeline.svg_string or ""),
+            "points_in": pipeline.point_stats["points_in"],
+            "points_out": pipeline.point_stats["points_out"],
+            "text_lines": len(ocr_results["labels"]),
+        },
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "stages": results,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--strokes", type=int, default=500)
+    parser.add_argument("--page-width", type=int, default=1200)
+    parser.add_argument("--page-height", type=int, default=1600)
+    parser.add_argument("--text-density", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--simplify-tolerance", type=float, default=0.5,
+                        help="stroke simplification tolerance in pixels, 0 turns it off")
+    parser.add_argument("--model", action="store_true", help="time the real Florence-2 model instead of the stub")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    for name, result in report["stages"].items():
+        if "skipped" in result:
+            print(f"{name:>18}  skipped: {result['skipped']}")
+        else:
+            print(f"{name:>18} {result['mean_ms']:>10.2f} ms  (min {result['min_ms']:.2f}, max {result['max_ms']:.2f})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,83 @@
+# synthetic /process_svg payloads that look like what the app sends: pen
+# strokes grouped into words and lines of text plus some free drawing, each
+# path with the bounds the app computes, and the app's 500 padding viewbox
+import random
+
+WORDS = ("the quick brown fox jumps over lazy dog notes pen paper smart lecture "
+         "meeting summary review draft chapter figure table index result method").split()
+PADDING = 500
+
+# polylines in the app's own "M12,30L13,31" form
+def _stroke_data(points):
+    return "".join(f"{'L' if i else 'M'}{x:.0f},{y:.0f}" for i, (x, y) in enumerate(points))
+
+def _path(points, stroke_size, erase=False):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return {
+        "type": "path",
+        "data": _stroke_data(points),
+        "erase": erase,
+        "color": "black",
+        "strokeSize": stroke_size,
+        # bounds over every point, same as Skia's getBounds
+        "bounds": {"x": min(xs), "y": min(ys), "width": max(xs) - min(xs), "height": max(ys) - min(ys)},
+    }
+
+# strokes: total number of paths. text_density: share of them that are
+# handwriting laid out in lines, the rest is free drawing below the text.
+# returns the request payload plus the expected text lines as stub ocr output
+def synthetic_page(strokes=500, page_width=1200, page_height=1600, text_density=0.8,
+                   line_height=60, stroke_size=3, erase_every=25, seed=0):
+    rng = random.Random(seed)
+    paths = []
+    quad_boxes = []
+    labels = []
+
+    text_strokes = int(strokes * text_density)
+    x, y = 0.0, 0.0
+    line_start = len(paths)
+    line_words = []
+    while len(paths) < text_strokes:
+        # a word is a handful of letter strokes
+        word = rng.choice(WORDS)
+        for _ in range(min(len(word), text_strokes - len(paths))):
+            points = [(x + rng.uniform(0, 14), y + rng.uniform(0, line_height * 0.6))
+                      for _ in range(rng.choice((3, 5, 7, 9)))]
+            erase = erase_every > 0 and len(paths) % erase_every == erase_every - 1
+            paths.append(_path(points, stroke_size, erase))
+            x += 16
+        line_words.append(word)
+        x += 24
+        if x > page_width or len(paths) >= text_strokes:
+            # the line's box in image pixels, like florence's quad boxes
+            line = paths[line_start:]
+            min_x = min(p["bounds"]["x"] for p in line) + PADDING
+            min_y = min(p["bounds"]["y"] for p in line) + PADDING
+            max_x = max(p["bounds"]["x"] + p["bounds"]["width"] for p in line) + PADDING
+            max_y = max(p["bounds"]["y"] + p["bounds"]["height"] for p in line) + PADDING
+            quad_boxes.append([min_x, min_y, max_x, min_y, max_x, max_y, min_x, max_y])
+            labels.append("</s>" + " ".join(line_words))
+            x = 0.0
+            y += line_height
+            line_start = len(paths)
+            line_words = []
+
+    # free drawing fills the rest of the page under the text
+    figure_top = y + line_height
+    while len(paths) < strokes:
+        cx = rng.uniform(0, page_width)
+        cy = rng.uniform(figure_top, max(page_height, figure_top + 1))
+        points = [(cx + rng.uniform(-80, 80), cy + rng.uniform(-80, 80)) for _ in range(rng.choice((5, 9, 13)))]
+        paths.append(_path(points, stroke_size))
+
+    content_height = max(page_height, max(p["bounds"]["y"] + p["bounds"]["height"] for p in paths) if paths else 0)
+    viewbox = {
+        "minx": -PADDING,
+        "miny": -PADDING,
+        "width": page_width + 2 * PADDING,
+        "height": content_height + 2 * PADDING,
+    }
+    payload = {"svgPaths": paths, "viewbox": viewbox}
+    ocr_results = {"quad_boxes": quad_boxes, "labels": labels}
+    return payload, ocr_results
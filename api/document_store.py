@@ -0,0 +1,269 @@
+import json
+import logging
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+# ids are the page's cache key, a sha256 hex digest
+DOCUMENT_ID = re.compile(r"[0-9a-f]{64}")
+SPILL_SUFFIX = ".npz"
+
+# size of a document in memory: the raster dominates, strokes are counted by
+# their points and ocr results by their json size
+def document_bytes(document):
+    size = len(json.dumps(document["ocr_results"]))
+    for path_info in document["svgPaths"]:
+        points = path_info.get("points") if isinstance(path_info, dict) else None
+        size += 200 + (points.nbytes if points is not None else len(str(path_info.get("data", ""))))
+    image = document.get("image")
+    if image is not None:
+        size += image.width * image.height * len(image.getbands())
+    return size
+
+# a document as npz arrays: stroke points and the raster as arrays of their
+# own, everything else as json. read back with allow_pickle=False, so a spill
+# file can only ever hold data
+def encode_document(document):
+    arrays = {}
+    paths = []
+    point_paths = []
+    for i, path_info in enumerate(document["svgPaths"]):
+        if isinstance(path_info, dict) and path_info.get("points") is not None:
+            path_info = dict(path_info)
+            arrays[f"points_{i}"] = np.asarray(path_info.pop("points"))
+            point_paths.append(i)
+        paths.append(path_info)
+    image = document.get("image")
+    if image is not None:
+        arrays["image"] = np.asarray(image)
+    meta = {
+        "svgPaths": paths,
+        "viewbox": document["viewbox"],
+        "ocr_results": document["ocr_results"],
+        "point_paths": point_paths,
+    }
+    arrays["document"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+    return arrays
+
+def decode_document(arrays):
+    meta = json.loads(arrays["document"].tobytes().decode("utf-8"))
+    paths = meta["svgPaths"]
+    for i in meta["point_paths"]:
+        paths[i]["points"] = arrays[f"points_{i}"]
+    image = Image.fromarray(arrays["image"]) if "image" in arrays else None
+    return {"svgPaths": paths, "viewbox": meta["viewbox"], "ocr_results": meta["ocr_results"], "image": image}
+
+# pages /process_svg has seen, so plugins can refer to them by id instead of
+# uploading the strokes and ocr results again. keeps the strokes, viewbox,
+# ocr results and the rendered page. the least recently used documents are
+# moved to spill_dir once the ones in memory pass max_bytes, and dropped for
+# good once the spilled ones pass max_spill_bytes (or right away without a
+# spill_dir). ids are the page's cache key, so the same page is one document
+class DocumentStore:
+    def __init__(self, max_bytes=256 * 1024 * 1024, spill_dir=None, max_spill_bytes=2 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        # on their way to disk, still readable from here
+        self.spilling = {}
+        self.spilled = OrderedDict()
+        self.spill_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if spill_dir and not self._private_dir(spill_dir):
+            self.spill_dir = None
+        if self.spill_dir:
+            self._load_index()
+
+    def put(self, document_id, svg_paths, viewbox, ocr_results, image=None):
+        document = {"svgPaths": list(svg_paths), "viewbox": viewbox, "ocr_results": ocr_results, "image": image}
+        with self.lock:
+            if image is None:
+                # same id means the same page, keep the raster it already had
+                old = self.memory.get(document_id) or self.spilling.get(document_id)
+                if old is not None:
+                    document["image"] = old[0]["image"]
+            self._insert(document_id, document)
+            to_spill = self._evict_memory()
+        self._spill(to_spill)
+
+    # the document as a new dict, or None if it was never stored or is gone.
+    # ocr results are a fresh copy, latex() appends to the labels
+    def get(self, document_id):
+        if not isinstance(document_id, str) or not DOCUMENT_ID.fullmatch(document_id):
+            return None
+        document = self._lookup(document_id)
+        if document is None:
+            return None
+        return {
+            "svgPaths": list(document["svgPaths"]),
+            "viewbox": dict(document["viewbox"]),
+            "ocr_results": json.loads(json.dumps(document["ocr_results"])),
+            "image": document["image"],
+        }
+
+    # the stored raster of a document, None when there is none
+    def image(self, document_id):
+        with self.lock:
+            entry = self.memory.get(document_id) or self.spilling.get(document_id)
+            if entry is not None:
+                return entry[0]["image"]
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "spills": self.spills,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "documents": len(self.memory) + len(self.spilling),
+                "bytes": self.memory_bytes,
+                "max_bytes": self.max_bytes,
+                "spilled_documents": len(self.spilled),
+                "spilled_bytes": self.spill_bytes,
+                "max_spilled_bytes": self.max_spill_bytes,
+            }
+
+    def _lookup(self, document_id):
+        with self.lock:
+            entry = self.memory.get(document_id)
+            if entry is not None:
+                self.memory.move_to_end(document_id)
+                self.hits += 1
+                return entry[0]
+            entry = self.spilling.get(document_id)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            if document_id not in self.spilled:
+                self.misses += 1
+                return None
+            path = self._path(document_id)
+
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                document = decode_document(arrays)
+        except (OSError, ValueError, KeyError, IndexError, zipfile.BadZipFile) as e:
+            logging.error(f"Error reading spilled document: {e}")
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # back into memory, it is being used again
+        with self.lock:
+            self.hits += 1
+            self.loads += 1
+            if document_id in self.spilled:
+                self.spill_bytes -= self.spilled.pop(document_id)
+                self._remove(document_id)
+            if document_id not in self.memory:
+                self._insert(document_id, document)
+            to_spill = self._evict_memory()
+        self._spill(to_spill)
+        return document
+
+    # caller holds the lock
+    def _insert(self, document_id, document):
+        size = document_bytes(document)
+        if document_id in self.memory:
+            self.memory_bytes -= self.memory.pop(document_id)[1]
+        if document_id in self.spilled:
+            self.spill_bytes -= self.spilled.pop(document_id)
+            self._remove(document_id)
+        self.memory[document_id] = (document, size)
+        self.memory_bytes += size
+
+    # least recently used documents over the memory budget, the newest one
+    # always stays. caller holds the lock
+    def _evict_memory(self):
+        evicted = []
+        while len(self.memory) > 1 and self.memory_bytes > self.max_bytes:
+            document_id, entry = self.memory.popitem(last=False)
+            self.memory_bytes -= entry[1]
+            if self.spill_dir:
+                self.spilling[document_id] = entry
+            else:
+                self.evictions += 1
+            evicted.append(document_id)
+        return evicted if self.spill_dir else []
+
+    def _spill(self, document_ids):
+        for document_id in document_ids:
+            with self.lock:
+                entry = self.spilling.get(document_id)
+            if entry is None:
+                continue
+            try:
+                tmp_path = self._path(document_id) + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, **encode_document(entry[0]))
+                os.replace(tmp_path, self._path(document_id))
+                size = os.path.getsize(self._path(document_id))
+            except OSError as e:
+                logging.error(f"Error spilling document: {e}")
+                size = None
+            with self.lock:
+                # put() may have brought it back in the meantime
+                if self.spilling.pop(document_id, None) is None or document_id in self.memory:
+                    if size is not None and document_id not in self.spilled:
+                        self._remove(document_id)
+                    continue
+                if size is None:
+                    self.evictions += 1
+                    continue
+                self.spilled[document_id] = size
+                self.spill_bytes += size
+                self.spills += 1
+                self._evict_disk()
+
+    # caller holds the lock
+    def _evict_disk(self):
+        while self.spilled and self.spill_bytes > self.max_spill_bytes:
+            document_id, size = self.spilled.popitem(last=False)
+            self.spill_bytes -= size
+            self.evictions += 1
+            self._remove(document_id)
+
+    def _path(self, document_id):
+        return os.path.join(self.spill_dir, f"{document_id}{SPILL_SUFFIX}")
+
+    def _remove(self, document_id):
+        try:
+            os.remove(self._path(document_id))
+        except OSError:
+            pass
+
+    # the spill directory must belong to this user and be closed to everyone
+    # else, otherwise others could put documents in it or read them
+    def _private_dir(self, path):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.stat(path)
+        if hasattr(os, "getuid") and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+            logging.error(f"Not spilling documents to {path}, it must be owned by this user with mode 0700")
+            return False
+        return True
+
+    # documents spilled by an earlier run are still good, oldest first
+    def _load_index(self):
+        files = [f for f in os.listdir(self.spill_dir)
+                 if f.endswith(SPILL_SUFFIX) and DOCUMENT_ID.fullmatch(f[:-len(SPILL_SUFFIX)])]
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.spill_dir, f)))
+        for name in files:
+            size = os.path.getsize(os.path.join(self.spill_dir, name))
+            self.spilled[name[:-len(SPILL_SUFFIX)]] = size
+            self.spill_bytes += size
+        self._evict_disk()
+        self.evictions = 0
+        logging.info(f"Found {len(self.spilled)} spilled documents")
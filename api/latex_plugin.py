@@ -1,37 +1,64 @@
 import logging
 import os
 import re
-from latexcompiler import LC
+import cairosvg
+import numpy as np
 import mistletoe
 from mistletoe.latex_renderer import LaTeXRenderer
-
-# turn the path and text data into proper svg xml string
-def create_svg_string(paths, viewbox):
-    if ('minx' not in viewbox or 'miny' not in viewbox or 'width' not in viewbox or 'height' not in viewbox):
-        logging.exception("Viewbox not properly defined")
-        return;
-    svg_elements = []
-    # Basic SVG structure
-    svg_header = f'<svg width="{viewbox['width']}" height="{viewbox['height']}" viewBox="{viewbox['minx']} {viewbox['miny']} {viewbox['width']} {viewbox['height']}" xmlns="http://www.w3.org/2000/svg">'
-
-    # Add path elements based on type
-    for path_info in paths:
-        strokeSize = path_info.get("strokeSize", 1);
-        color = path_info.get("color", "black")
-        if path_info.get("type") == "text":
-            x = path_info.get("x", 0)
-            y = path_info.get("y", 0)
-            content = path_info.get("data", "")
-            dy=strokeSize*0.75
-            svg_elements.append(f'<text x="{x}" y="{y}" fill="{color}" font-size="{strokeSize}" dy="{dy}">{content}</text>')
-        else:
-            path_data = path_info.get("data", "")
-            erase = path_info.get("erase", "false")
-            finalColor = "white" if erase else color
-            svg_elements.append(f'<path d="{path_data}" stroke="{finalColor}" fill="none" stroke-width="{strokeSize}"/>')
-
-    svg_footer = '</svg>'
-    return "\n".join([svg_header] + svg_elements + [svg_footer])
+from render import create_svg_string, render_pdf
+from ocr_cache import cache_key
+from quad_index import QuadGridIndex
+from latex_pool import LatexJobPool, LatexCompileError
+from pdf_cache import PDFCache, pdf_key
+from metrics import span
+
+# folder holding semester.tex and anything it includes
+template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
+
+# compiles run in parallel, each in its own scratch directory
+latex_pool = LatexJobPool(
+    template_dir,
+    max_workers=int(os.environ.get("LATEX_WORKERS", 0)) or None,
+    max_pending=int(os.environ.get("LATEX_MAX_PENDING", 0)) or None,
+    timeout=float(os.environ.get("LATEX_TIMEOUT", 60)),
+    work_root=os.environ.get("LATEX_WORK_DIR") or None,
+)
+
+# exporting again without edits returns the pdf that was already built
+pdf_cache = PDFCache(
+    max_bytes=int(os.environ.get("PDF_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+    cache_dir=os.environ.get("PDF_CACHE_DIR") or None,
+)
+
+# the free drawing figure as pdf, by the hash of its paths. text edits
+# recompile with the figure that is already drawn
+figure_cache = PDFCache(max_bytes=int(os.environ.get("FIGURE_CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+
+# the free paths as a pdf for \includegraphics, going through svg only for
+# path data the direct renderer doesn't handle. returns the pdf and its key,
+# (None, None) when the paths draw nothing
+def figure_pdf(paths, viewbox):
+    if not paths:
+        return None, None
+    # the figure is cropped to its strokes, the page viewbox doesn't change it
+    key = cache_key(paths, {})
+    pdf = figure_cache.get(key)
+    if pdf is not None:
+        return pdf, key
+    try:
+        with span("figure_render"):
+            pdf = render_pdf(paths)
+    except ValueError as e:
+        logging.info(f"Falling back to SVG for the figure: {e}")
+        svg_string = create_svg_string(paths, viewbox)
+        if not svg_string:
+            return None, None
+        with span("figure_svg_render"):
+            pdf = cairosvg.svg2pdf(bytestring=svg_string.encode('utf-8'))
+    if pdf is None:
+        return None, None
+    figure_cache.put(key, pdf)
+    return pdf, key
 
 def check_point(centerX, centerY, x1, y1, x2, y2, x3, y3, x4, y4): 
     def cross_product(oax, oay, obx, oby, opx, opy):
@@ -56,45 +83,43 @@ def latex(data, plugin_options, svg_paths):
     free_paths = []
     nonfree_paths = []
 
-    print(data)
-    print(svg_paths)
+    logging.debug(data)
+    logging.debug(svg_paths)
 
-    for path in svg_paths['svgPaths']:
-        print("we got a path")
+    # path centers in image pixels (the app pads the page by 500 on each side)
+    paths = svg_paths['svgPaths']
+    centers = np.empty((len(paths), 2), dtype=np.float64)
+    for i, path in enumerate(paths):
         pathBound = path['bounds']
-        height = pathBound['height']
-        width = pathBound['width']
         minX = pathBound['x'] + 500
         minY = pathBound['y'] + 500
+        centers[i, 0] = minX + pathBound['width'] / 2.0
+        centers[i, 1] = minY + pathBound['height'] / 2.0
 
-        centerX = minX + width / 2.0
-        centerY = minY + height / 2.0
-        found_in_quadbox = False
-        for bound in data['quad_boxes']:
-            print("we got a bound")
-            x1, y1, x2, y2, x3, y3, x4, y4 = bound
-            contains = check_point(centerX, centerY, x1, y1, x2, y2, x3, y3, x4, y4)
-            if(contains):
-                found_in_quadbox = True;
-                break;
+    # test every center against the quad boxes in one go
+    with span("classify_paths"):
+        in_text = QuadGridIndex(data['quad_boxes']).contains(centers)
+    for path, found_in_quadbox in zip(paths, in_text):
         if not found_in_quadbox:
             free_paths.append(path)
         else:
             nonfree_paths.append(path)
     pdfData = data['labels'];
 
-    svg_string = create_svg_string(free_paths, svg_paths['viewbox'])
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    tmp_dir_path = os.path.join(script_dir, "tmp")
-    svg_file_path = os.path.join(tmp_dir_path, 'generated_image.svg')
-    if(svg_string):
-        with open(svg_file_path, "w") as f:
-            f.write(svg_string)
+    # extra files the job needs next to output.tex, and what stands in for
+    # each of them in the cache keys
+    job_files = {}
+    key_files = {}
+    figure, figure_key = figure_pdf(free_paths, svg_paths['viewbox'])
+    if figure is not None:
+        job_files['generated_image.pdf'] = figure
+        # cairo stamps every pdf with its creation date, the paths' hash doesn't change
+        key_files['generated_image.pdf'] = figure_key
 
         pdfData.append(r'''
         \begin{figure}[h!]
             \centering
-            \includesvg[width=0.7\textwidth]{generated_image}
+            \includegraphics[width=0.7\textwidth]{generated_image}
             \caption{Figure caption}
             \label{fig:my_svg}
         \end{figure}
@@ -104,7 +129,8 @@ def latex(data, plugin_options, svg_paths):
 
 
     # Remove </s> from response
-    rendered = mistletoe.markdown(text.replace("</s>", ""), LaTeXRenderer)
+    with span("markdown_render"):
+        rendered = mistletoe.markdown(text.replace("</s>", ""), LaTeXRenderer)
 
 
     # Remove the article start document and end document lines since unneeded
@@ -119,8 +145,7 @@ def latex(data, plugin_options, svg_paths):
     rendered = rendered.replace('\\', '\\\\')
 
     # Path to your LaTeX file
-    directory = os.path.dirname(os.path.abspath(__file__))
-    tex_file = os.path.join(directory, 'tmp', 'semester.tex')
+    tex_file = os.path.join(template_dir, 'semester.tex')
 
     # Read the content of the LaTeX file
     with open(tex_file, 'r') as f:
@@ -132,14 +157,20 @@ def latex(data, plugin_options, svg_paths):
     # Replace the matched content with new content
     new_tex_content = re.sub(pattern, rendered, tex_content, flags=re.DOTALL)
 
-    # Write the modified content back to the file
-    output_file = os.path.join(directory, 'tmp', 'output.tex')
-    with open(output_file, 'w') as f:
-        f.write(new_tex_content)
+    key = pdf_key(new_tex_content, key_files)
+    pdf = pdf_cache.get(key)
+    if pdf is not None:
+        return pdf
 
+    # compile in a scratch directory and hand back the pdf bytes. the aux files
+    # of the last compile of this template and figure are reused when only the
+    # text changed
+    aux_key = pdf_key(tex_content, key_files)
     try:
-        LC.compile_document(tex_engine = 'pdflatex', bib_engine = 'biber', no_bib=True, path=output_file, folder_name = '.aux_files')
-    except:
-        print("bad latex data")
-
-    return 'tmp/output.pdf'
+        with span("latex_compile"):
+            pdf = latex_pool.compile(new_tex_content, job_files, aux_key=aux_key)
+    except LatexCompileError as e:
+        logging.error(f"bad latex data: {e}")
+        return None
+    pdf_cache.put(key, pdf)
+    return pdf
@@ -0,0 +1,147 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# files pdflatex writes for the next pass (references, toc, hyperref outlines)
+AUX_EXTENSIONS = (".aux", ".toc", ".out", ".lof", ".lot", ".nav", ".snm")
+
+class LatexPoolFull(Exception):
+    pass
+
+class LatexCompileError(Exception):
+    pass
+
+# runs pdflatex jobs in parallel, each in its own scratch directory so
+# concurrent exports can't overwrite each other's files. template_dir holds
+# the user's template and anything it includes, it is put on TEXINPUTS so
+# jobs don't need their own copy of it.
+# auxiliary files of the last compile of each aux_key are kept, a job that
+# starts from them usually needs a single pdflatex pass instead of two
+class LatexJobPool:
+    def __init__(self, template_dir, max_workers=None, max_pending=None, timeout=60, work_root=None, max_aux_sets=32):
+        self.template_dir = template_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.work_root = work_root
+        if work_root:
+            os.makedirs(work_root, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="latex")
+        # running plus queued jobs, beyond this new exports are turned away
+        self.max_pending = max_pending or self.max_workers * 4
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.max_aux_sets = max_aux_sets
+        self.aux_files = OrderedDict()
+        self.aux_lock = threading.Lock()
+
+    # compile tex_content with extra files (name -> str or bytes) next to it
+    # and return the pdf bytes
+    def compile(self, tex_content, files=None, aux_key=None):
+        if not self.slots.acquire(blocking=False):
+            raise LatexPoolFull("Too many LaTeX jobs queued")
+        self._count_pending(1)
+        try:
+            future = self.executor.submit(self._run, tex_content, files or {}, aux_key)
+        except Exception:
+            self._count_pending(-1)
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: (self._count_pending(-1), self.slots.release()))
+        return future.result()
+
+    def stats(self):
+        with self.pending_lock:
+            pending = self.pending
+        return {
+            "pending": pending,
+            "max_pending": self.max_pending,
+            "workers": self.max_workers,
+        }
+
+    def _count_pending(self, change):
+        with self.pending_lock:
+            self.pending += change
+
+    def _run(self, tex_content, files, aux_key):
+        job_dir = tempfile.mkdtemp(prefix="latex-", dir=self.work_root)
+        try:
+            seeded = False
+            if aux_key is not None:
+                with self.aux_lock:
+                    aux_files = self.aux_files.get(aux_key)
+                    if aux_files is not None:
+                        self.aux_files.move_to_end(aux_key)
+                for name, content in (aux_files or {}).items():
+                    with open(os.path.join(job_dir, name), "wb") as f:
+                        f.write(content)
+                seeded = bool(aux_files)
+            for name, content in files.items():
+                mode = "wb" if isinstance(content, bytes) else "w"
+                with open(os.path.join(job_dir, name), mode) as f:
+                    f.write(content)
+            with open(os.path.join(job_dir, "output.tex"), "w") as f:
+                f.write(tex_content)
+
+            command = ["pdflatex", "-interaction=nonstopmode", "--file-line-error", "output.tex"]
+
+            env = dict(os.environ)
+            # trailing separator keeps the default search path
+            env["TEXINPUTS"] = self.template_dir + os.pathsep + env.get("TEXINPUTS", "")
+
+            # two passes like LC.compile_document so references resolve. starting
+            # from the previous aux files the second one is only needed when
+            # latex asks for a rerun or the first pass changed any of them, the
+            # toc and outline don't ask
+            for compile_pass in range(2):
+                if (compile_pass == 1 and seeded and not self._needs_rerun(job_dir)
+                        and self._read_aux_files(job_dir) == aux_files):
+                    break
+                try:
+                    subprocess.run(
+                        command,
+                        cwd=job_dir, env=env, timeout=self.timeout,
+                        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    )
+                except subprocess.TimeoutExpired:
+                    raise LatexCompileError(f"LaTeX compile took longer than {self.timeout}s")
+                except FileNotFoundError:
+                    raise LatexCompileError("pdflatex not found")
+
+            pdf_path = os.path.join(job_dir, "output.pdf")
+            if not os.path.isfile(pdf_path):
+                raise LatexCompileError("LaTeX compile produced no PDF")
+            with open(pdf_path, "rb") as f:
+                pdf = f.read()
+            if aux_key is not None:
+                self._keep_aux_files(aux_key, job_dir)
+            return pdf
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _needs_rerun(self, job_dir):
+        try:
+            with open(os.path.join(job_dir, "output.log"), "r", errors="replace") as f:
+                return "Rerun" in f.read()
+        except OSError:
+            return True
+
+    def _read_aux_files(self, job_dir):
+        aux_files = {}
+        for name in os.listdir(job_dir):
+            if name.endswith(AUX_EXTENSIONS):
+                with open(os.path.join(job_dir, name), "rb") as f:
+                    aux_files[name] = f.read()
+        return aux_files
+
+    def _keep_aux_files(self, aux_key, job_dir):
+        aux_files = self._read_aux_files(job_dir)
+        with self.aux_lock:
+            self.aux_files[aux_key] = aux_files
+            self.aux_files.move_to_end(aux_key)
+            while len(self.aux_files) > self.max_aux_sets:
+                self.aux_files.popitem(last=False)
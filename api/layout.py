@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+import numpy as np
+from ocr_session import path_bounds, translate_quad
+
+# white space around each block so strokes at its edge aren't cut off
+BLOCK_MARGIN = 20
+
+# (n, 4) minx, miny, maxx, maxy of every path including the stroke width, or
+# None when a path has no bounds to place it by
+def stroke_boxes(paths):
+    boxes = np.empty((len(paths), 4), dtype=np.float64)
+    for i, path_info in enumerate(paths):
+        box = path_bounds(path_info)
+        if box is None:
+            return None
+        boxes[i] = box
+    return boxes
+
+# line number of every stroke, lines numbered top to bottom. a line ends where
+# the projection profile of the stroke bounds onto the y axis stays empty for
+# more than gap. the profile is read off the strokes sorted by their top
+# instead of a histogram, a new line starts at a stroke whose top is below
+# everything above it
+def line_numbers(tops, bottoms, gap):
+    order = np.argsort(tops, kind="stable")
+    covered = np.maximum.accumulate(bottoms[order])
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = tops[order][1:] > covered[:-1] + gap
+    lines = np.empty(len(order), dtype=np.int64)
+    lines[order] = np.cumsum(starts) - 1
+    return lines
+
+# splits tall pages into blocks of whole text lines, each small enough that the
+# model sees its strokes at their drawn size and writes a short answer. pages
+# no taller than min_page_height are left whole. a line taller than
+# max_block_height (a drawing, say) is a block of its own
+class LineSegmenter:
+    def __init__(self, min_page_height=1024, max_block_height=256, line_gap=8):
+        self.min_page_height = min_page_height
+        self.max_block_height = max_block_height
+        self.line_gap = line_gap
+        self.pages = 0
+        self.segmented = 0
+        self.lines = 0
+        self.blocks_out = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    # (paths, viewbox) of every block in reading order, or None when the page
+    # should be ocr'd whole. block viewboxes are in svg coordinates like the page's
+    def blocks(self, paths, viewbox):
+        with self.lock:
+            self.pages += 1
+        if self.min_page_height <= 0 or float(viewbox['height']) <= self.min_page_height:
+            return None
+        start = time.perf_counter()
+        boxes = stroke_boxes(paths)
+        if boxes is None:
+            return None
+        if len(boxes) == 0:
+            return []
+
+        lines = line_numbers(boxes[:, 1], boxes[:, 3], self.line_gap)
+        line_count = int(lines.max()) + 1
+        line_top = np.full(line_count, np.inf)
+        line_bottom = np.full(line_count, -np.inf)
+        np.minimum.at(line_top, lines, boxes[:, 1])
+        np.maximum.at(line_bottom, lines, boxes[:, 3])
+
+        # whole lines go into a block until the next one would make it too tall
+        block_of_line = np.zeros(line_count, dtype=np.int64)
+        block = 0
+        block_top = line_top[0]
+        for line in range(1, line_count):
+            if line_bottom[line] - block_top > self.max_block_height:
+                block += 1
+                block_top = line_top[line]
+            block_of_line[line] = block
+        block_count = block + 1
+        stroke_block = block_of_line[lines]
+
+        extents = np.empty((block_count, 4))
+        extents[:, :2] = np.inf
+        extents[:, 2:] = -np.inf
+        np.minimum.at(extents[:, 0], stroke_block, boxes[:, 0])
+        np.minimum.at(extents[:, 1], stroke_block, boxes[:, 1])
+        np.maximum.at(extents[:, 2], stroke_block, boxes[:, 2])
+        np.maximum.at(extents[:, 3], stroke_block, boxes[:, 3])
+        page = (float(viewbox['minx']), float(viewbox['miny']),
+                float(viewbox['minx']) + float(viewbox['width']), float(viewbox['miny']) + float(viewbox['height']))
+        extents[:, :2] = np.maximum(np.floor(extents[:, :2] - BLOCK_MARGIN), page[:2])
+        extents[:, 2:] = np.minimum(np.ceil(extents[:, 2:] + BLOCK_MARGIN), page[2:])
+
+        # each block draws only its own strokes, in page order so erasing still
+        # paints over what it erased
+        members = [[] for _ in range(block_count)]
+        for path_info, b in zip(paths, stroke_block.tolist()):
+            members[b].append(path_info)
+        blocks = []
+        for (minx, miny, maxx, maxy), block_paths in zip(extents.tolist(), members):
+            if maxx <= minx or maxy <= miny:
+                continue
+            blocks.append((block_paths, {'minx': minx, 'miny': miny, 'width': maxx - minx, 'height': maxy - miny}))
+
+        with self.lock:
+            self.segmented += 1
+            self.lines += line_count
+            self.blocks_out += len(blocks)
+            self.seconds += time.perf_counter() - start
+        logging.debug(f"Split page into {line_count} lines in {len(blocks)} blocks")
+        return blocks
+
+    # ocr results of the blocks as the results of the whole page. block images
+    # start at the block corner, their boxes move back into page pixels
+    def merge(self, blocks, viewbox, results):
+        quad_boxes = []
+        labels = []
+        for (_, block_viewbox), block_results in zip(blocks, results):
+            dx = block_viewbox['minx'] - float(viewbox['minx'])
+            dy = block_viewbox['miny'] - float(viewbox['miny'])
+            for quad, label in zip(block_results.get('quad_boxes', []), block_results.get('labels', [])):
+                quad_boxes.append(translate_quad(quad, dx, dy))
+                labels.append(label)
+        return {'quad_boxes': quad_boxes, 'labels': labels}
+
+    def stats(self):
+        with self.lock:
+            return {
+                "min_page_height": self.min_page_height,
+                "max_block_height": self.max_block_height,
+                "pages": self.pages,
+                "segmented_pages": self.segmented,
+                "lines": self.lines,
+                "blocks": self.blocks_out,
+                "seconds": self.seconds,
+            }
@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+def _same(value):
+    return value
+
+# LRU store of values kept serialized, bounded by their total size and
+# optionally by entry count. encode turns a value into bytes and decode turns
+# them back, so every get returns its own copy. if cache_dir is set entries
+# are also written there as <key><suffix> and reloaded on startup
+class LRUStore:
+    def __init__(self, name, max_bytes, max_entries=None, cache_dir=None, suffix=".bin", encode=_same, decode=_same):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.suffix = suffix
+        self.encode = encode
+        self.decode = decode
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_from_disk()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return self.decode(data)
+
+    def put(self, key, value):
+        data = self.encode(value)
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.size += len(data)
+            evicted = self._evict()
+        if self.cache_dir:
+            self._write(key, data)
+            for old_key in evicted:
+                self._remove(old_key)
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+            if self.max_entries is not None:
+                stats["max_entries"] = self.max_entries
+            return stats
+
+    # drop least recently used entries until within budget, caller holds the lock
+    def _evict(self):
+        evicted = []
+        while self.entries and (self.size > self.max_bytes or
+                                (self.max_entries is not None and len(self.entries) > self.max_entries)):
+            key, data = self.entries.popitem(last=False)
+            self.size -= len(data)
+            self.evictions += 1
+            evicted.append(key)
+        return evicted
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.suffix}")
+
+    def _write(self, key, data):
+        try:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.error(f"Error writing {self.name} entry: {e}")
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    # load the most recently written entries that fit in the budget
+    def _load_from_disk(self):
+        files = [f for f in os.listdir(self.cache_dir) if f.endswith(self.suffix)]
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.cache_dir, f)))
+        for name in files:
+            try:
+                with open(os.path.join(self.cache_dir, name), "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            self.entries[name[:-len(self.suffix)]] = data
+            self.size += len(data)
+        for key in self._evict():
+            self._remove(key)
+        self.evictions = 0
+        logging.info(f"Loaded {len(self.entries)} {self.name} entries from disk")
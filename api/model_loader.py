@@ -0,0 +1,71 @@
+import logging
+import os
+import threading
+import time
+from huggingface_hub import snapshot_download
+
+# everything else in startup timings is measured from here
+PROCESS_START = time.perf_counter()
+
+# weights are read from here, only missing models are downloaded
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR") or None
+# formats transformers never loads for torch, no point downloading them
+IGNORE_PATTERNS = ["*.msgpack", "*.h5", "*.ot", "*.onnx", "*.tflite", "flax_model*", "tf_model*"]
+
+# local folder with the model files, downloading them only if they aren't cached yet.
+# from_pretrained on this folder memory maps safetensors weights instead of copying them
+def model_path(name):
+    try:
+        return snapshot_download(name, cache_dir=MODEL_CACHE_DIR, local_files_only=True)
+    except Exception:
+        logging.info(f"{name} not in local cache, downloading")
+        return snapshot_download(name, cache_dir=MODEL_CACHE_DIR, ignore_patterns=IGNORE_PATTERNS)
+
+# loads a model on a background thread and tracks whether it is usable yet
+class ModelLoader:
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.state = "pending"
+        self.error = None
+        self.load_seconds = None
+        self.first_inference_seconds = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.state = "loading"
+            self.thread = threading.Thread(target=self._run, name=f"load-{self.name}", daemon=True)
+            self.thread.start()
+
+    # called after every inference, only the first one is recorded
+    def record_inference(self):
+        if self.first_inference_seconds is None:
+            self.first_inference_seconds = time.perf_counter() - PROCESS_START
+
+    def status(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "first_inference_seconds": self.first_inference_seconds,
+        }
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.load()
+            self.state = "ready"
+            logging.info(f"Loaded {self.name} model in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            logging.error(f"Error loading {self.name} model: {e}")
+            self.error = str(e)
+            self.state = "failed"
+        self.load_seconds = time.perf_counter() - start
@@ -0,0 +1,98 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# collects ocr requests that arrive close together and runs them through the
+# model as a single batch. run_batch takes a list of items and must return a
+# list of results in the same order. with concurrency above 1 that many
+# batches run at once (one per ocr worker process), the next batch keeps
+# filling up while they are all busy
+class OCRBatcher:
+    def __init__(self, run_batch, window_ms=20, max_batch_size=8, concurrency=1):
+        self.run_batch = run_batch
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.concurrency = max(1, concurrency)
+        self.slots = threading.Semaphore(self.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ocr-batch")
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.last_batch_size = 0
+        self.last_batch_latency = 0.0
+        self.total_batch_latency = 0.0
+        self.worker = threading.Thread(target=self._loop, name="ocr-batcher", daemon=True)
+        self.worker.start()
+
+    # queue one item for the next batch, the returned future holds its result
+    def submit(self, item):
+        future = Future()
+        self.requests.put((item, future))
+        return future
+
+    def stats(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "last_batch_size": self.last_batch_size,
+                "last_batch_latency": self.last_batch_latency,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "avg_batch_latency": self.total_batch_latency / self.batches if self.batches else 0.0,
+            }
+
+    # block for the first request, then keep collecting until the window
+    # closes or the batch is full
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            # wait for a free slot first so requests pile up into the next batch meanwhile
+            self.slots.acquire()
+            batch = self._collect()
+            # skip requests whose caller already gave up
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                self.slots.release()
+                continue
+            self.executor.submit(self._run, batch)
+
+    # runs on the executor, frees the slot for the next batch when done
+    def _run(self, batch):
+        try:
+            start = time.perf_counter()
+            try:
+                results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                logging.exception("OCR batch failed")
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            latency = time.perf_counter() - start
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+            with self.lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.last_batch_size = len(batch)
+                self.last_batch_latency = latency
+                self.total_batch_latency += latency
+            logging.info(f"OCR batch of {len(batch)} took {latency:.3f}s")
+        finally:
+            self.slots.release()
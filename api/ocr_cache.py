@@ -0,0 +1,32 @@
+import hashlib
+import json
+from lru_store import LRUStore
+from stroke_format import path_identity
+
+# canonical hash of everything that changes the rendered page. paths keep
+# their order since erase strokes paint over the ones before them
+def cache_key(paths, viewbox):
+    canonical_paths = []
+    for path_info in paths:
+        canonical_paths.append([
+            path_info.get("type", "path"),
+            path_identity(path_info),
+            float(path_info.get("strokeSize", 1)),
+            # same truthiness create_svg_string uses to paint a stroke white
+            bool(path_info.get("erase", "false")),
+            path_info.get("color", "black"),
+            path_info.get("x", 0),
+            path_info.get("y", 0),
+        ])
+    canonical_viewbox = [float(viewbox.get(k, 0)) for k in ("minx", "miny", "width", "height")]
+    payload = json.dumps([canonical_viewbox, canonical_paths], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# LRU cache of ocr results bounded by entry count and serialized size.
+# if cache_dir is set entries are also written to disk and reloaded on startup
+class OCRCache(LRUStore):
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, cache_dir=None):
+        super().__init__(
+            "OCR cache", max_bytes, max_entries=max_entries, cache_dir=cache_dir, suffix=".json",
+            encode=lambda results: json.dumps(results).encode("utf-8"), decode=json.loads,
+        )
@@ -0,0 +1,105 @@
+import logging
+import os
+import torch
+from transformers import AutoProcessor, AutoModelForCausalLM
+from model_loader import model_path
+from metrics import span
+
+# the florence-2 model and its inference, loaded into whichever process
+# imports this: the server, or each ocr worker process (see ocr_pool.py).
+# batching, the worker pool and load state live in ocr_model.py
+
+MODEL_NAME = "microsoft/Florence-2-large"
+
+# inference settings, picked with OCR_PROFILE. quantize swaps the linear layers
+# for dynamic int8 ones and compile runs the vision tower and language model
+# through torch.compile, both only apply on CPU.
+# see benchmarks/ocr_profile_benchmark.py for what each one costs in accuracy
+PROFILES = {
+    "accurate": {"quantize": False, "compile": False, "num_beams": 3, "max_new_tokens": 4096},
+    "compiled": {"quantize": False, "compile": True, "num_beams": 3, "max_new_tokens": 4096},
+    "quantized": {"quantize": True, "compile": False, "num_beams": 3, "max_new_tokens": 4096},
+    "fast": {"quantize": True, "compile": False, "num_beams": 1, "max_new_tokens": 1024},
+}
+# submodules torch.compile is applied to, the generate loop itself stays eager
+COMPILED_MODULES = ["vision_tower", "language_model.model.encoder", "language_model.model.decoder"]
+
+def profile_settings(name):
+    if name not in PROFILES:
+        raise ValueError(f"Unknown OCR profile {name}, expected one of {', '.join(PROFILES)}")
+    settings = dict(PROFILES[name])
+    # individual generation settings can still be overridden
+    if os.environ.get("OCR_NUM_BEAMS"):
+        settings["num_beams"] = int(os.environ["OCR_NUM_BEAMS"])
+    if os.environ.get("OCR_MAX_NEW_TOKENS"):
+        settings["max_new_tokens"] = int(os.environ["OCR_MAX_NEW_TOKENS"])
+    return settings
+
+profile = profile_settings(os.environ.get("OCR_PROFILE", "accurate"))
+
+# hold ocr model so it doesn't have to be loaded over and over
+model = None
+processor = None
+device = "cuda:0" if torch.cuda.is_available() else "cpu"
+torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+
+def load_model():
+    global model, processor
+    path = model_path(MODEL_NAME)
+    # low_cpu_mem_usage maps the weights in place instead of building a random model first
+    loaded_model = AutoModelForCausalLM.from_pretrained(path, trust_remote_code=True, low_cpu_mem_usage=True).to(device, torch_dtype)
+    loaded_processor = AutoProcessor.from_pretrained(path, trust_remote_code=True)
+    loaded_model.eval()
+    model, processor = apply_profile(loaded_model, profile), loaded_processor
+
+def apply_profile(loaded_model, settings):
+    if device != "cpu":
+        if settings["quantize"] or settings["compile"]:
+            logging.info("Skipping CPU only OCR profile settings on GPU")
+        return loaded_model
+    if settings["quantize"]:
+        loaded_model = torch.ao.quantization.quantize_dynamic(loaded_model, {torch.nn.Linear}, dtype=torch.qint8)
+    if settings["compile"]:
+        for name in COMPILED_MODULES:
+            parent_name, _, child_name = name.rpartition(".")
+            parent = loaded_model
+            for part in filter(None, parent_name.split(".")):
+                parent = getattr(parent, part, None)
+            module = getattr(parent, child_name, None) if parent is not None else None
+            if module is None:
+                logging.info(f"OCR model has no {name} to compile")
+                continue
+            # decoder inputs grow every step, dynamic avoids a recompile per length
+            setattr(parent, child_name, torch.compile(module, dynamic=True))
+    return loaded_model
+
+# run a list of RGB images through the model in a single generate call
+def ocr_batch(images):
+    if model is None or processor is None:
+        raise RuntimeError("OCR model not loaded")
+
+    # Define the prompt for OCR
+    prompt = '<OCR_WITH_REGION>'
+    # every image is resized to the same input resolution and the prompt is
+    # identical, so the batch pads into one set of tensors
+    with span("ocr_preprocess"):
+        inputs = processor(text=[prompt] * len(images), images=images, return_tensors="pt").to(device, torch_dtype)
+
+    # Generate the output using the model
+    with span("ocr_generate"), torch.no_grad():
+        generated_ids = model.generate(
+            input_ids=inputs["input_ids"],
+            pixel_values=inputs["pixel_values"],
+            max_new_tokens=profile["max_new_tokens"],
+            num_beams=profile["num_beams"],
+            do_sample=False
+        )
+
+    # Decode and return the generated text and bounds for each image
+    with span("ocr_postprocess"):
+        generated_texts = processor.batch_decode(generated_ids, skip_special_tokens=False)
+        results = []
+        for image, generated_text in zip(images, generated_texts):
+            parsed_answer = processor.post_process_generation(generated_text, task=prompt, image_size=(image.width, image.height))
+            results.append(parsed_answer['<OCR_WITH_REGION>'])
+    return results
@@ -0,0 +1,151 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+
+class JobQueueFull(Exception):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, payload):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.state = "queued"
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        self.finished_at = None
+        # bumped on every change so event streams know when to send an update
+        self.version = 0
+        self.changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed", "cancelled")
+
+    def update(self, **fields):
+        with self.changed:
+            self._set(**fields)
+
+    # move a queued job to running, False if it was cancelled meanwhile
+    def start(self):
+        with self.changed:
+            if self.state != "queued":
+                return False
+            self._set(state="running")
+            return True
+
+    def request_cancel(self):
+        with self.changed:
+            if self.finished:
+                return
+            if self.state == "queued":
+                self._set(state="cancelled", cancel_requested=True)
+            else:
+                self._set(cancel_requested=True)
+
+    # caller holds self.changed
+    def _set(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        if self.finished and self.finished_at is None:
+            self.finished_at = time.monotonic()
+        self.version += 1
+        self.changed.notify_all()
+
+    # block until the job changes after version, returns the new version
+    def wait_for_change(self, version, timeout):
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def status(self):
+        status = {"id": self.id, "state": self.state, "stage": self.stage}
+        if self.state == "done":
+            status["result"] = self.result
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+# bounded queue of background jobs worked off by a few threads.
+# run(payload, progress) does the work and calls progress(stage) between
+# stages, which is also where a cancelled job stops
+class JobQueue:
+    def __init__(self, run, workers=4, max_queued=64, ttl=300):
+        self.run = run
+        self.ttl = ttl
+        self.pending = queue.Queue(maxsize=max_queued)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self._loop, name=f"ocr-job-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, payload):
+        self._drop_expired()
+        job = Job(payload)
+        with self.lock:
+            self.jobs[job.id] = job
+        try:
+            self.pending.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job.id]
+            raise JobQueueFull("Too many OCR jobs queued")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    # queued jobs are dropped straight away, running ones stop at their next stage
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.request_cancel()
+        return job
+
+    def stats(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return {
+            "queued": self.pending.qsize(),
+            "running": sum(1 for job in jobs if job.state == "running"),
+            "max_queued": self.pending.maxsize,
+        }
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at is not None and now - job.finished_at > self.ttl]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def _loop(self):
+        while True:
+            job = self.pending.get()
+            if not job.start():
+                continue
+
+            def progress(stage):
+                if job.cancel_requested:
+                    raise JobCancelled()
+                job.update(stage=stage)
+
+            try:
+                result = self.run(job.payload, progress)
+                job.update(state="done", stage=None, result=result)
+            except JobCancelled:
+                job.update(state="cancelled")
+            except Exception as e:
+                logging.exception("OCR job failed")
+                job.update(state="failed", error=str(e))
@@ -1,65 +1,46 @@
-import io
-from PIL import Image
-import torch
-from transformers import AutoProcessor, AutoModelForCausalLM
-import logging
-
-# hold ocr model so it doesn't have to be loaded over and over
-model = None
-processor = None
-device = "cuda:0" if torch.cuda.is_available() else "cpu"
-torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-
-# load the ocr model as soon as the module is loaded
-try:
-    model = AutoModelForCausalLM.from_pretrained("microsoft/Florence-2-large", trust_remote_code=True).to(device, torch_dtype)
-    processor = AutoProcessor.from_pretrained("microsoft/Florence-2-large", trust_remote_code=True)
-    logging.info("Loaded OCR model")
-except Exception as e:
-    logging.error(f"Error loading OCR model: {e}")
-    model = None
-    processor = None
-
-
-def ocr(image_data_bytes):
-    if model is None or processor is None:
-        logging.exception("Model not loaded before OCR")
-
-    image_file = io.BytesIO(image_data_bytes)
-    image = Image.open(image_file)
-    if image.mode == "RGBA":
-        # Create a new RGB image with a white background
-        rgb_image = Image.new("RGB", image.size, (255, 255, 255))
-        # Paste the RGBA image onto the white background
-        rgb_image.paste(image, mask=image.split()[3])  # Use the alpha channel as a mask
-        image = rgb_image
-    elif image.mode != "RGB":
-        image = image.convert("RGB")  # Convert other modes to RGB
-
-    # Define the prompt for OCR
-    prompt = '<OCR_WITH_REGION>'
-    inputs = processor(text=prompt, images=image, return_tensors="pt").to(device, torch_dtype)
-
-    # Move tensors to the correct device and dtype
-    # inputs = {
-    #     k: v.to(device=device, dtype=torch.int64) if k == "input_ids" else v.to(device=device, dtype=torch.float32)
-    #     if torch.is_tensor(v) else v
-    #     for k, v in inputs.items()
-    # }
-
-    # Generate the output using the model
-    with torch.no_grad():
-        generated_ids = model.generate(
-            input_ids=inputs["input_ids"],
-            pixel_values=inputs["pixel_values"],
-            max_new_tokens=4096,
-            num_beams=3,
-            do_sample=False
-        )
-
-    # Decode and return the generated text and bounds
-    generated_text = processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-    parsed_answer = processor.post_process_generation(generated_text, task=prompt, image_size=(image.width, image.height))
-    print(parsed_answer)
-    return parsed_answer['<OCR_WITH_REGION>']
-
+import os
+import ocr_engine
+from ocr_engine import load_model
+from ocr_batcher import OCRBatcher
+from ocr_pool import OCRWorkerPool
+from model_loader import ModelLoader
+
+# requests arriving within this window (or until the batch is full) share one generate call
+OCR_BATCH_WINDOW_MS = float(os.environ.get("OCR_BATCH_WINDOW_MS", 20))
+OCR_MAX_BATCH_SIZE = int(os.environ.get("OCR_MAX_BATCH_SIZE", 8))
+# above 0 the model runs in this many worker processes instead of the server
+# process, each with OCR_WORKER_THREADS torch threads (default: cores / workers)
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 0))
+OCR_WORKER_THREADS = int(os.environ.get("OCR_WORKER_THREADS", 0)) or None
+OCR_WORKER_TIMEOUT = float(os.environ.get("OCR_WORKER_TIMEOUT", 0)) or None
+
+# worker processes that each hold their own copy of the model, see ocr_pool.py
+pool = OCRWorkerPool(OCR_WORKERS, OCR_WORKER_THREADS, job_timeout=OCR_WORKER_TIMEOUT) if OCR_WORKERS > 0 else None
+
+# loaded in the background once the server starts it, see /ready
+loader = ModelLoader("ocr", pool.start if pool else load_model)
+
+# run a list of RGB images through the model in this process
+def ocr_batch(images):
+    results = ocr_engine.ocr_batch(images)
+    loader.record_inference()
+    return results
+
+# same as ocr_batch, on whichever worker process has the least to do
+def pooled_ocr_batch(images):
+    results = pool.run(images)
+    loader.record_inference()
+    return results
+
+# one batch in flight per worker process
+batcher = OCRBatcher(
+    pooled_ocr_batch if pool else ocr_batch,
+    window_ms=OCR_BATCH_WINDOW_MS,
+    max_batch_size=OCR_MAX_BATCH_SIZE,
+    concurrency=OCR_WORKERS if pool else 1,
+)
+
+# submit several images at once so they can share a batch
+def ocr_images(images):
+    futures = [batcher.submit(image) for image in images]
+    return [future.result() for future in futures]
@@ -0,0 +1,298 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+from metrics import stage_seconds
+
+# stands in for the stage histogram inside a worker, the parent records the
+# timings it sends back
+class _StageLog:
+    def __init__(self):
+        self.entries = []
+
+    def observe(self, value, stage):
+        self.entries.append((stage, value))
+
+# runs in each worker process: loads the model once with a fixed number of
+# torch threads, then ocrs batches of pages read out of shared memory
+def _worker_main(index, threads, cpus, jobs, results):
+    # pin before torch starts its thread pools so they inherit the cores
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    import metrics
+    metrics.stage_seconds = _StageLog()
+    # only the model, none of the server's batching, caches or threads
+    import ocr_engine
+
+    try:
+        ocr_engine.load_model()
+    except Exception as e:
+        results.put(("failed", index, None, str(e)))
+        return
+    results.put(("ready", index, None, os.getpid()))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, shared = job
+        # the job timeout counts from here, not from when it was queued
+        results.put(("started", index, job_id, None))
+        metrics.stage_seconds.entries = []
+        try:
+            images = []
+            for name, (width, height) in shared:
+                # the parent created the block and unlinks it once the result is back
+                block = shared_memory.SharedMemory(name=name)
+                try:
+                    with block.buf[:width * height * 3] as pixels:
+                        images.append(Image.frombytes("RGB", (width, height), pixels))
+                finally:
+                    block.close()
+            output = ocr_engine.ocr_batch(images)
+            results.put(("done", index, job_id, (output, metrics.stage_seconds.entries)))
+        except Exception as e:
+            logging.exception("OCR worker batch failed")
+            results.put(("error", index, job_id, str(e)))
+
+class _Worker:
+    def __init__(self, index, cpus):
+        self.index = index
+        self.cpus = cpus
+        self.process = None
+        self.jobs = None
+        self.pid = None
+        self.state = "stopped"
+        self.error = None
+        # images sent to this worker that haven't come back yet
+        self.load = 0
+        self.batches = 0
+        self.images = 0
+        self.restarts = 0
+
+# ocr model replicas in separate processes, so preprocessing, generation and
+# post processing of different batches don't share one GIL and one stuck
+# generation only ties up its own worker. pages travel through shared memory
+# as raw RGB pixels, batches go to the worker with the fewest images
+# outstanding. a worker that dies or exceeds job_timeout is restarted and its
+# batch fails
+class OCRWorkerPool:
+    def __init__(self, workers, threads_per_worker=None, pin_cpus=True, job_timeout=None):
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+        self.threads = threads_per_worker or max(1, len(cpus) // workers)
+        self.job_timeout = job_timeout
+        # each worker gets its own run of cores, unless there aren't enough to go round
+        pin_cpus = pin_cpus and workers * self.threads <= len(cpus)
+        self.workers = [_Worker(i, cpus[i * self.threads:(i + 1) * self.threads] if pin_cpus else None)
+                        for i in range(workers)]
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.pending = {}
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.collector = None
+
+    # start every worker and wait until one has its model loaded, raises if
+    # they all failed. used as the ocr ModelLoader's load function
+    def start(self, timeout=None):
+        with self.lock:
+            if self.collector is None:
+                for worker in self.workers:
+                    self._spawn(worker)
+                self.collector = threading.Thread(target=self._collect, name="ocr-pool", daemon=True)
+                self.collector.start()
+            ready = self.changed.wait_for(
+                lambda: any(w.state == "ready" for w in self.workers) or all(w.state == "failed" for w in self.workers),
+                timeout,
+            )
+            if not ready:
+                raise TimeoutError("No OCR worker loaded its model in time")
+            if not any(w.state == "ready" for w in self.workers):
+                raise RuntimeError(f"Every OCR worker failed to load: {self.workers[0].error}")
+        logging.info(f"OCR worker pool started, {len(self.workers)} workers with {self.threads} threads each")
+
+    # ocr a batch of images on the least loaded worker and wait for the results
+    def run(self, images):
+        return self.submit(images).result()
+
+    def submit(self, images):
+        blocks = []
+        shared = []
+        try:
+            for image in images:
+                pixels = np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+                block = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(pixels.shape, dtype=np.uint8, buffer=block.buf)[...] = pixels
+                shared.append((block.name, (pixels.shape[1], pixels.shape[0])))
+        except Exception:
+            _release(blocks)
+            raise
+
+        future = Future()
+        with self.lock:
+            ready = [w for w in self.workers if w.state == "ready"]
+            if not ready:
+                _release(blocks)
+                raise RuntimeError("No OCR worker is ready")
+            # ties go to the worker that has done the least so far
+            worker = min(ready, key=lambda w: (w.load, w.images))
+            job_id = next(self.job_ids)
+            # then when the worker started on it, and what it was sent
+            self.pending[job_id] = [worker, future, blocks, None, shared]
+            worker.load += len(images)
+            worker.jobs.put((job_id, shared))
+        return future
+
+    def stats(self):
+        with self.lock:
+            return {
+                "threads_per_worker": self.threads,
+                "pending_batches": len(self.pending),
+                "workers": [{
+                    "state": w.state,
+                    "pid": w.pid,
+                    "cpus": w.cpus,
+                    "load": w.load,
+                    "batches": w.batches,
+                    "images": w.images,
+                    "restarts": w.restarts,
+                    "error": w.error,
+                } for w in self.workers],
+            }
+
+    def close(self):
+        with self.lock:
+            for worker in self.workers:
+                if worker.process is not None and worker.process.is_alive():
+                    worker.jobs.put(None)
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+    # caller holds the lock
+    def _spawn(self, worker):
+        worker.jobs = self.context.Queue()
+        worker.process = self.context.Process(
+            target=_worker_main,
+            args=(worker.index, self.threads, worker.cpus, worker.jobs, self.results),
+            name=f"ocr-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.state = "starting"
+        worker.pid = None
+        worker.load = 0
+        worker.process.start()
+
+    def _collect(self):
+        while True:
+            try:
+                kind, index, job_id, payload = self.results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            with self.lock:
+                worker = self.workers[index]
+                if kind == "ready":
+                    worker.state = "ready"
+                    worker.pid = payload
+                    worker.error = None
+                elif kind == "failed":
+                    logging.error(f"OCR worker {index} failed to load: {payload}")
+                    worker.state = "failed"
+                    worker.error = payload
+                    # batches handed over from the worker it replaced
+                    stranded = [self.pending.pop(i) for i, e in list(self.pending.items()) if e[0] is worker]
+                    for entry in stranded:
+                        worker.load -= len(entry[2])
+                        _release(entry[2])
+                        entry[1].set_exception(RuntimeError(f"OCR worker failed to load: {payload}"))
+                elif kind == "started" and job_id in self.pending:
+                    self.pending[job_id][3] = time.monotonic()
+                self.changed.notify_all()
+                entry = self.pending.pop(job_id, None) if kind in ("done", "error") else None
+                if entry is not None:
+                    worker.load -= len(entry[2])
+                    if kind == "done":
+                        worker.batches += 1
+                        worker.images += len(entry[2])
+            if entry is None:
+                self._check_workers()
+                continue
+            _, future, blocks, _, _ = entry
+            _release(blocks)
+            if kind == "done":
+                output, stages = payload
+                for stage, seconds in stages:
+                    stage_seconds.observe(seconds, stage=stage)
+                future.set_result(output)
+            else:
+                future.set_exception(RuntimeError(f"OCR worker failed: {payload}"))
+            self._check_workers()
+
+    # restart workers that died or got stuck, failing the batches they held.
+    # batches waiting behind a stuck one go to its replacement instead
+    def _check_workers(self):
+        now = time.monotonic()
+        failed = []
+        with self.lock:
+            for worker in self.workers:
+                if worker.process is None or worker.state in ("failed", "stopped"):
+                    continue
+                jobs = [job_id for job_id, entry in self.pending.items() if entry[0] is worker]
+                # batches queued behind the running one haven't started yet
+                stuck = self.job_timeout and any(self.pending[job_id][3] is not None and
+                                                 now - self.pending[job_id][3] > self.job_timeout for job_id in jobs)
+                if worker.process.is_alive() and not stuck:
+                    continue
+                if stuck:
+                    logging.error(f"OCR worker {worker.index} exceeded {self.job_timeout}s, restarting it")
+                    worker.process.terminate()
+                    worker.process.join(timeout=5)
+                else:
+                    logging.error(f"OCR worker {worker.index} exited with {worker.process.exitcode}, restarting it")
+                # a worker that crashed may not have said it started a batch,
+                # so only the batches a stuck one never took are kept
+                waiting = [job_id for job_id in jobs if stuck and self.pending[job_id][3] is None]
+                for job_id in jobs:
+                    if job_id not in waiting:
+                        failed.append(self.pending.pop(job_id))
+                # one that never loaded would only fail again
+                if worker.state == "starting":
+                    worker.state = "failed"
+                    worker.error = f"exited with {worker.process.exitcode} while loading"
+                    self.changed.notify_all()
+                    continue
+                worker.restarts += 1
+                self._spawn(worker)
+                for job_id in waiting:
+                    entry = self.pending[job_id]
+                    worker.load += len(entry[2])
+                    worker.jobs.put((job_id, entry[4]))
+        for _, future, blocks, _, _ in failed:
+            _release(blocks)
+            future.set_exception(RuntimeError("OCR worker stopped before finishing the batch"))
+
+def _release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
@@ -0,0 +1,199 @@
+import json
+import logging
+import threading
+from collections import Counter, OrderedDict
+from stroke_format import path_identity
+
+# extra space around changed strokes so the model sees some context
+REGION_MARGIN = 20
+# above this share of the page it is cheaper to just ocr the whole thing
+MAX_DIRTY_FRACTION = 0.5
+
+# identity of a path for diffing between syncs
+def path_signature(path_info):
+    return json.dumps([
+        path_info.get("type", "path"),
+        path_identity(path_info),
+        path_info.get("strokeSize", 1),
+        bool(path_info.get("erase", "false")),
+        path_info.get("color", "black"),
+        path_info.get("x", 0),
+        path_info.get("y", 0),
+    ], separators=(",", ":"))
+
+# (minx, miny, maxx, maxy) of a path in svg coordinates including the stroke width
+def path_bounds(path_info):
+    bounds = path_info.get("bounds")
+    if not bounds:
+        return None
+    half_stroke = float(path_info.get("strokeSize", 1)) / 2.0
+    x = float(bounds["x"])
+    y = float(bounds["y"])
+    return (x - half_stroke, y - half_stroke,
+            x + float(bounds["width"]) + half_stroke, y + float(bounds["height"]) + half_stroke)
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def area(box):
+    return max(0.0, box[2] - box[0]) * max(0.0, box[3] - box[1])
+
+# axis aligned bounds of an ocr quad box, moved from image pixels to svg coordinates
+def quad_bounds(quad, viewbox):
+    xs = quad[0::2]
+    ys = quad[1::2]
+    return (min(xs) + viewbox['minx'], min(ys) + viewbox['miny'],
+            max(xs) + viewbox['minx'], max(ys) + viewbox['miny'])
+
+def translate_quad(quad, dx, dy):
+    return [v + (dx if i % 2 == 0 else dy) for i, v in enumerate(quad)]
+
+# merge overlapping boxes until none of them touch
+def merge_boxes(boxes):
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if intersects(box, other):
+                    result[i] = union(box, other)
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+class _Session:
+    def __init__(self, signatures, bounds, viewbox, results):
+        self.signatures = signatures
+        self.bounds = bounds
+        self.viewbox = viewbox
+        self.results = results
+
+# keeps the last paths and ocr results of each document so a sync only sends
+# the regions whose strokes changed to the model.
+# run_ocr takes a list of (paths, viewbox) pages and returns their ocr results
+class OCRSessions:
+    def __init__(self, run_ocr, max_sessions=128):
+        self.run_ocr = run_ocr
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    # remember the result of a full page ocr done elsewhere (e.g. a cache hit)
+    def update(self, session_id, paths, viewbox, results):
+        signatures = [path_signature(p) for p in paths]
+        bounds = {sig: path_bounds(p) for sig, p in zip(signatures, paths)}
+        with self.lock:
+            self.sessions[session_id] = _Session(Counter(signatures), bounds, dict(viewbox), results)
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def ocr(self, session_id, paths, viewbox):
+        with self.lock:
+            previous = self.sessions.get(session_id)
+
+        regions = None
+        if previous is not None:
+            regions = self._dirty_regions(previous, paths, viewbox)
+
+        if regions is None:
+            results = self.run_ocr([(paths, viewbox)])[0]
+        elif len(regions) == 0:
+            results = previous.results
+        else:
+            results = self._ocr_regions(previous, paths, viewbox, regions)
+
+        self.update(session_id, paths, viewbox, results)
+        return results
+
+    # boxes (in svg coordinates) that need to be ocr'd again, or None when the
+    # whole page has to be redone
+    def _dirty_regions(self, previous, paths, viewbox):
+        signatures = [path_signature(p) for p in paths]
+        current = Counter(signatures)
+        added = current - previous.signatures
+        removed = previous.signatures - current
+        if not added and not removed:
+            return []
+
+        new_bounds = {sig: path_bounds(p) for sig, p in zip(signatures, paths)}
+        changed = []
+        for sig in added:
+            changed.append(new_bounds[sig])
+        for sig in removed:
+            changed.append(previous.bounds.get(sig))
+        if any(b is None for b in changed):
+            return None
+
+        changed = [(b[0] - REGION_MARGIN, b[1] - REGION_MARGIN, b[2] + REGION_MARGIN, b[3] + REGION_MARGIN) for b in changed]
+
+        # grow the regions over any recognized text they touch so words are
+        # always recognized as a whole
+        text_boxes = [quad_bounds(q, previous.viewbox) for q in previous.results.get('quad_boxes', [])]
+        regions = merge_boxes(changed)
+        grown = True
+        while grown:
+            grown = False
+            for i, region in enumerate(regions):
+                for box in text_boxes:
+                    if intersects(region, box) and union(region, box) != region:
+                        regions[i] = union(region, box)
+                        grown = True
+            regions = merge_boxes(regions)
+
+        page = (viewbox['minx'], viewbox['miny'], viewbox['minx'] + viewbox['width'], viewbox['miny'] + viewbox['height'])
+        regions = [(max(r[0], page[0]), max(r[1], page[1]), min(r[2], page[2]), min(r[3], page[3])) for r in regions]
+        regions = [r for r in regions if area(r) > 0]
+
+        if sum(area(r) for r in regions) > MAX_DIRTY_FRACTION * area(page):
+            return None
+        return regions
+
+    def _ocr_regions(self, previous, paths, viewbox, regions):
+        # keep the old text that is outside every changed region, shifted in
+        # case the page grew past its old top left corner
+        kept = []
+        old_results = previous.results
+        shift_x = previous.viewbox['minx'] - viewbox['minx']
+        shift_y = previous.viewbox['miny'] - viewbox['miny']
+        for quad, label in zip(old_results.get('quad_boxes', []), old_results.get('labels', [])):
+            box = quad_bounds(quad, previous.viewbox)
+            if not any(intersects(box, r) for r in regions):
+                kept.append((translate_quad(quad, shift_x, shift_y), label))
+
+        pages = []
+        for region in regions:
+            region_viewbox = {
+                'minx': region[0],
+                'miny': region[1],
+                'width': region[2] - region[0],
+                'height': region[3] - region[1],
+            }
+            # paths without bounds can't be placed so they are always drawn
+            region_paths = [p for p in paths if path_bounds(p) is None or intersects(path_bounds(p), region)]
+            pages.append((region_paths, region_viewbox))
+
+        logging.info(f"Incremental OCR of {len(regions)} regions")
+        region_results = self.run_ocr(pages)
+
+        # region images start at the region corner, move boxes back into page pixels
+        for region, results in zip(regions, region_results):
+            dx = region[0] - viewbox['minx']
+            dy = region[1] - viewbox['miny']
+            for quad, label in zip(results.get('quad_boxes', []), results.get('labels', [])):
+                kept.append((translate_quad(quad, dx, dy), label))
+
+        # back into reading order
+        kept.sort(key=lambda item: (min(item[0][1::2]), min(item[0][0::2])))
+        return {
+            'quad_boxes': [quad for quad, _ in kept],
+            'labels': [label for _, label in kept],
+        }
@@ -0,0 +1,20 @@
+import hashlib
+from lru_store import LRUStore
+
+# hash of the final tex source and every file compiled with it
+def pdf_key(tex_content, files):
+    digest = hashlib.sha256()
+    digest.update(tex_content.encode("utf-8"))
+    for name in sorted(files):
+        content = files[name]
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        digest.update(b"\0" + name.encode("utf-8") + b"\0")
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+# content addressed LRU store of compiled pdfs bounded by total size. if
+# cache_dir is set the pdfs are also kept on disk and reloaded on startup
+class PDFCache(LRUStore):
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        super().__init__("PDF cache", max_bytes, cache_dir=cache_dir, suffix=".pdf")
@@ -0,0 +1,104 @@
+import numpy as np
+
+# same expression as check_point's cross_product, evaluated over arrays
+def cross_product(oax, oay, obx, oby, opx, opy):
+    return (obx - oax) * (opy - oay) - (oby - oay) * (opx - oax)
+
+# check_point for many (point, quad) pairs at once. points is (N, 2), quads (N, 8)
+def points_in_quads(points, quads):
+    px = points[:, 0]
+    py = points[:, 1]
+    x1, y1, x2, y2, x3, y3, x4, y4 = quads.T
+    cp1 = cross_product(x1, y1, x2, y2, px, py)
+    cp2 = cross_product(x2, y2, x3, y3, px, py)
+    cp3 = cross_product(x3, y3, x4, y4, px, py)
+    cp4 = cross_product(x4, y4, x1, y1, px, py)
+    return (((cp1 >= 0) & (cp2 >= 0) & (cp3 >= 0) & (cp4 >= 0)) |
+            ((cp1 <= 0) & (cp2 <= 0) & (cp3 <= 0) & (cp4 <= 0)))
+
+# uniform grid over the ocr quad boxes. each convex quad is filed under every
+# cell its bounding box touches so a point only gets tested against the quads
+# sharing its cell. quads that aren't strictly convex can accept points outside
+# their bounding box under check_point's rule, so they are tested against every point
+class QuadGridIndex:
+    def __init__(self, quad_boxes, cell_size=None):
+        self.quads = np.asarray(quad_boxes, dtype=np.float64).reshape(-1, 8)
+        xs = self.quads[:, 0::2]
+        ys = self.quads[:, 1::2]
+
+        # turn direction at every corner, all the same sign means strictly convex
+        ex = np.roll(xs, -1, axis=1) - xs
+        ey = np.roll(ys, -1, axis=1) - ys
+        turns = ex * np.roll(ey, -1, axis=1) - ey * np.roll(ex, -1, axis=1)
+        convex = np.all(turns > 0, axis=1) | np.all(turns < 0, axis=1)
+        self.global_ids = np.nonzero(~convex)[0]
+        grid_ids = np.nonzero(convex)[0]
+
+        self.min_x = xs.min(axis=1)
+        self.min_y = ys.min(axis=1)
+        max_x = xs.max(axis=1)
+        max_y = ys.max(axis=1)
+
+        if cell_size is None:
+            # about one line of text per cell
+            heights = (max_y - self.min_y)[grid_ids]
+            cell_size = float(np.median(heights)) if len(heights) else 1.0
+        self.cell_size = max(cell_size, 1.0)
+
+        if len(grid_ids) == 0:
+            self.cell_keys = np.empty(0, dtype=np.int64)
+            self.cell_quads = np.empty(0, dtype=np.int64)
+            return
+
+        self.origin_x = self.min_x[grid_ids].min()
+        self.origin_y = self.min_y[grid_ids].min()
+        cx0 = self._cell(self.min_x[grid_ids], self.origin_x)
+        cy0 = self._cell(self.min_y[grid_ids], self.origin_y)
+        cx1 = self._cell(max_x[grid_ids], self.origin_x)
+        cy1 = self._cell(max_y[grid_ids], self.origin_y)
+        self.columns = int(cx1.max()) + 1
+
+        # one (cell, quad) pair for every cell a quad covers
+        spans_x = cx1 - cx0 + 1
+        spans_y = cy1 - cy0 + 1
+        counts = spans_x * spans_y
+        owner = np.repeat(np.arange(len(grid_ids)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = cx0[owner] + offset % spans_x[owner]
+        cell_y = cy0[owner] + offset // spans_x[owner]
+        keys = cell_y * self.columns + cell_x
+
+        order = np.argsort(keys, kind="stable")
+        self.cell_keys = keys[order]
+        self.cell_quads = grid_ids[owner[order]]
+
+    def _cell(self, values, origin):
+        return np.floor((values - origin) / self.cell_size).astype(np.int64)
+
+    # True for every point that falls inside at least one quad
+    def contains(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        found = np.zeros(len(points), dtype=bool)
+
+        if len(self.cell_keys):
+            cx = self._cell(points[:, 0], self.origin_x)
+            cy = self._cell(points[:, 1], self.origin_y)
+            in_grid = (cx >= 0) & (cy >= 0) & (cx < self.columns)
+            keys = np.where(in_grid, cy * self.columns + cx, -1)
+
+            # all candidate quads of each point's cell
+            start = np.searchsorted(self.cell_keys, keys, side="left")
+            end = np.searchsorted(self.cell_keys, keys, side="right")
+            counts = np.where(in_grid, end - start, 0)
+            point_ids = np.repeat(np.arange(len(points)), counts)
+            offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            quad_ids = self.cell_quads[np.repeat(start, counts) + offset]
+
+            inside = points_in_quads(points[point_ids], self.quads[quad_ids])
+            found[point_ids[inside]] = True
+
+        for quad_id in self.global_ids:
+            quads = np.broadcast_to(self.quads[quad_id], (len(points), 8))
+            found |= points_in_quads(points, quads)
+
+        return found
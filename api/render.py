@@ -0,0 +1,216 @@
+import io
+import logging
+import re
+import sys
+import cairocffi as cairo
+import numpy as np
+from PIL import Image
+from cairosvg.colors import color as parse_color
+from stroke_format import path_data
+
+# turn the path and text data into proper svg xml string
+def create_svg_string(paths, viewbox):
+    if ('minx' not in viewbox or 'miny' not in viewbox or 'width' not in viewbox or 'height' not in viewbox):
+        logging.exception("Viewbox not properly defined")
+        return;
+    svg_elements = []
+    # Basic SVG structure
+    svg_header = f'<svg width="{viewbox['width']}" height="{viewbox['height']}" viewBox="{viewbox['minx']} {viewbox['miny']} {viewbox['width']} {viewbox['height']}" xmlns="http://www.w3.org/2000/svg">'
+
+    # Add path elements based on type
+    for path_info in paths:
+        strokeSize = path_info.get("strokeSize", 1);
+        color = path_info.get("color", "black")
+        if path_info.get("type") == "text":
+            x = path_info.get("x", 0)
+            y = path_info.get("y", 0)
+            content = path_info.get("data", "")
+            dy=strokeSize*0.75
+            svg_elements.append(f'<text x="{x}" y="{y}" fill="{color}" font-size="{strokeSize}" dy="{dy}">{content}</text>')
+        else:
+            erase = path_info.get("erase", "false")
+            finalColor = "white" if erase else color
+            svg_elements.append(f'<path d="{path_data(path_info)}" stroke="{finalColor}" fill="none" stroke-width="{strokeSize}"/>')
+
+    svg_footer = '</svg>'
+    return "\n".join([svg_header] + svg_elements + [svg_footer])
+
+# decode png bytes into an RGB image on a white background
+def png_to_image(image_data_bytes):
+    image_file = io.BytesIO(image_data_bytes)
+    image = Image.open(image_file)
+    if image.mode == "RGBA":
+        # Create a new RGB image with a white background
+        rgb_image = Image.new("RGB", image.size, (255, 255, 255))
+        # Paste the RGBA image onto the white background
+        rgb_image.paste(image, mask=image.split()[3])  # Use the alpha channel as a mask
+        image = rgb_image
+    elif image.mode != "RGB":
+        image = image.convert("RGB")  # Convert other modes to RGB
+    return image
+
+PATH_TOKEN = re.compile(r'[MmLlHhVvCcSsQqTtZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+# how many numbers each path command takes
+PATH_ARGS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'Z': 0}
+
+# replay svg path data onto a cairo context. raises ValueError for commands
+# the pen app never produces (arcs) so the caller can fall back to cairosvg
+def draw_path_data(ctx, path_data):
+    tokens = PATH_TOKEN.findall(path_data)
+    if PATH_TOKEN.sub('', path_data).strip(' ,\t\r\n'):
+        raise ValueError(f"Unsupported path data: {path_data[:40]}")
+
+    x = y = 0.0
+    start_x = start_y = 0.0
+    # last control point and whether it came from a cubic ('C') or quadratic
+    # ('Q') curve, the smooth curve commands reflect it
+    control = None
+    control_kind = None
+    command = None
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+        elif command is None:
+            raise ValueError("Path data must start with a command")
+
+        upper = command.upper()
+        count = PATH_ARGS[upper]
+        args = [float(v) for v in tokens[i:i + count]]
+        if len(args) < count:
+            raise ValueError(f"Missing numbers for path command {command}")
+        i += count
+        relative = command.islower()
+        previous_control = control if control_kind == ('C' if upper in ('C', 'S') else 'Q') else None
+        control = control_kind = None
+
+        if upper == 'M':
+            if relative:
+                args = [args[0] + x, args[1] + y]
+            x, y = args
+            start_x, start_y = x, y
+            ctx.move_to(x, y)
+            # extra pairs after a moveto are linetos
+            command = 'l' if relative else 'L'
+        elif upper == 'L':
+            if relative:
+                args = [args[0] + x, args[1] + y]
+            x, y = args
+            ctx.line_to(x, y)
+        elif upper == 'H':
+            x = args[0] + x if relative else args[0]
+            ctx.line_to(x, y)
+        elif upper == 'V':
+            y = args[0] + y if relative else args[0]
+            ctx.line_to(x, y)
+        elif upper in ('C', 'S'):
+            if relative:
+                args = [v + (x if j % 2 == 0 else y) for j, v in enumerate(args)]
+            if upper == 'S':
+                # first control point mirrors the previous curve's second one
+                if previous_control is None:
+                    args = [x, y] + args
+                else:
+                    args = [2 * x - previous_control[0], 2 * y - previous_control[1]] + args
+            ctx.curve_to(*args)
+            control, control_kind = (args[2], args[3]), 'C'
+            x, y = args[4], args[5]
+        elif upper in ('Q', 'T'):
+            if relative:
+                args = [v + (x if j % 2 == 0 else y) for j, v in enumerate(args)]
+            if upper == 'T':
+                if previous_control is None:
+                    args = [x, y] + args
+                else:
+                    args = [2 * x - previous_control[0], 2 * y - previous_control[1]] + args
+            qx, qy, end_x, end_y = args
+            # cairo only has cubic curves, raise the quadratic to one
+            ctx.curve_to(x + 2.0 / 3.0 * (qx - x), y + 2.0 / 3.0 * (qy - y),
+                         end_x + 2.0 / 3.0 * (qx - end_x), end_y + 2.0 / 3.0 * (qy - end_y),
+                         end_x, end_y)
+            control, control_kind = (qx, qy), 'Q'
+            x, y = end_x, end_y
+        elif upper == 'Z':
+            ctx.close_path()
+            x, y = start_x, start_y
+
+# strokes uploaded in binary are already points, no parsing needed
+def draw_points(ctx, points):
+    coords = points.tolist()
+    if not coords:
+        return
+    ctx.move_to(*coords[0])
+    for x, y in coords[1:]:
+        ctx.line_to(x, y)
+
+# stroke and fill the paths and text the way create_svg_string's svg would
+def draw_paths(ctx, paths):
+    for path_info in paths:
+        strokeSize = float(path_info.get("strokeSize", 1))
+        color = path_info.get("color", "black")
+        if path_info.get("type") == "text":
+            # svg collapses whitespace inside text elements
+            content = " ".join(str(path_info.get("data", "")).split())
+            if not content:
+                continue
+            ctx.set_source_rgba(*parse_color(color))
+            ctx.select_font_face("sans-serif")
+            ctx.set_font_size(strokeSize)
+            ctx.move_to(float(path_info.get("x", 0)), float(path_info.get("y", 0)) + strokeSize * 0.75)
+            ctx.show_text(content)
+            ctx.new_path()
+        else:
+            erase = path_info.get("erase", "false")
+            finalColor = "white" if erase else color
+            if "points" in path_info:
+                draw_points(ctx, path_info["points"])
+            else:
+                draw_path_data(ctx, path_info.get("data", ""))
+            ctx.set_source_rgba(*parse_color(finalColor))
+            ctx.set_line_width(strokeSize)
+            ctx.stroke()
+
+# draw the paths straight into an RGB image without going through svg and png.
+# matches create_svg_string + cairosvg.svg2png + png_to_image
+def rasterize(paths, viewbox):
+    width = int(float(viewbox['width']))
+    height = int(float(viewbox['height']))
+    if width <= 0 or height <= 0:
+        raise ValueError("Viewbox not properly defined")
+
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+    ctx.translate(-float(viewbox['minx']), -float(viewbox['miny']))
+    # svg default, cairo's own is 10
+    ctx.set_miter_limit(4)
+
+    draw_paths(ctx, paths)
+
+    surface.flush()
+    # RGB24 is stored as native endian 32 bit words, BGRX on little endian machines
+    pixels = np.ndarray(shape=(height, surface.get_stride() // 4, 4), dtype=np.uint8, buffer=surface.get_data())
+    rgb = pixels[:, :width, 2::-1] if sys.byteorder == 'little' else pixels[:, :width, 1:]
+    return Image.fromarray(np.ascontiguousarray(rgb), "RGB")
+
+# the paths as a vector pdf cropped to the ink they leave, plus margin on each
+# side, for the latex figure. drawn once into a recording surface to find
+# the bounds, then replayed into the pdf. None when nothing is drawn
+def render_pdf(paths, margin=4):
+    recording = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+    ctx = cairo.Context(recording)
+    ctx.set_miter_limit(4)
+    draw_paths(ctx, paths)
+    x, y, width, height = recording.ink_extents()
+    if width <= 0 or height <= 0:
+        return None
+
+    output = io.BytesIO()
+    surface = cairo.PDFSurface(output, width + 2 * margin, height + 2 * margin)
+    ctx = cairo.Context(surface)
+    ctx.set_source_surface(recording, margin - x, margin - y)
+    ctx.paint()
+    surface.finish()
+    return output.getvalue()
@@ -1,20 +1,116 @@
 from transformers import pipeline
 import logging
+import re
+from model_loader import ModelLoader, model_path
+from metrics import span
+
+MODEL_NAME = "lxyuan/distilbert-base-multilingual-cased-sentiments-student"
+# chunks per forward pass in chunked mode
+DEFAULT_BATCH_SIZE = 16
 
 distilled_student_sentiment_classifier = None
 
-# load the ocr model as soon as the module is loaded
-try:
+def load_model():
+    global distilled_student_sentiment_classifier
+    # a local snapshot path has no hub metadata to infer the task from
     distilled_student_sentiment_classifier = pipeline(
-        model="lxyuan/distilbert-base-multilingual-cased-sentiments-student", 
+        task="text-classification",
+        model=model_path(MODEL_NAME),
         return_all_scores=True
     )
-except Exception as e:
-    logging.error(f"Error loading sentiment model: {e}")
+
+# loaded in the background once the server starts it, see /ready
+loader = ModelLoader("sentiment", load_model)
 
 def sentiment(data):
     if distilled_student_sentiment_classifier is None:
         logging.exception("Model not loaded before sentiment analysis")
         return;
 
-    return distilled_student_sentiment_classifier(data)
+    with span("sentiment"):
+        result = distilled_student_sentiment_classifier(data)
+    loader.record_inference()
+    return result
+
+# split text into pieces of at most max_tokens tokens, breaking between
+# paragraphs and sentences where possible
+def split_chunks(text, tokenizer, max_tokens):
+    sentences = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        parts = [p.strip() for p in re.split(r'(?<=[.!?])\s+', paragraph) if p.strip()]
+        # mark the first sentence of each paragraph so a chunk can end there
+        sentences.extend((i == 0, part) for i, part in enumerate(parts))
+    if not sentences:
+        return []
+
+    lengths = [len(ids) for ids in tokenizer([part for _, part in sentences], add_special_tokens=False)["input_ids"]]
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for (starts_paragraph, sentence), length in zip(sentences, lengths):
+        # a single sentence over the limit is cut into token windows
+        if length > max_tokens:
+            if current:
+                chunks.append((" ".join(current), current_tokens))
+                current, current_tokens = [], 0
+            ids = tokenizer(sentence, add_special_tokens=False)["input_ids"]
+            for start in range(0, len(ids), max_tokens):
+                window = ids[start:start + max_tokens]
+                chunks.append((tokenizer.decode(window), len(window)))
+            continue
+        # once a chunk is half full prefer to end it where a paragraph ends
+        if current and (current_tokens + length > max_tokens or
+                        (starts_paragraph and current_tokens >= max_tokens // 2)):
+            chunks.append((" ".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += length
+    if current:
+        chunks.append((" ".join(current), current_tokens))
+    return chunks
+
+# run long text through the classifier in token bounded chunks and batches,
+# returns per chunk scores and the token weighted average over all chunks
+def sentiment_chunked(data, batch_size=DEFAULT_BATCH_SIZE, max_tokens=None):
+    if distilled_student_sentiment_classifier is None:
+        logging.exception("Model not loaded before sentiment analysis")
+        return;
+
+    tokenizer = distilled_student_sentiment_classifier.tokenizer
+    # leave room for the [CLS] and [SEP] tokens. some tokenizers don't set a
+    # real model_max_length so the position embeddings bound it too
+    model_limit = getattr(distilled_student_sentiment_classifier.model.config, "max_position_embeddings", 512)
+    limit = min(tokenizer.model_max_length, model_limit) - tokenizer.num_special_tokens_to_add()
+    max_tokens = min(max_tokens or limit, limit)
+
+    chunks = split_chunks(data, tokenizer, max_tokens)
+    if not chunks:
+        return {"aggregate": [], "chunks": []}
+
+    with span("sentiment"):
+        results = distilled_student_sentiment_classifier(
+            [text for text, _ in chunks], batch_size=batch_size, truncation=True
+        )
+    loader.record_inference()
+
+    totals = {}
+    labels = []
+    total_tokens = 0
+    for (_, tokens), scores in zip(chunks, results):
+        # empty chunks still count a little so every chunk has a say
+        weight = max(tokens, 1)
+        total_tokens += weight
+        for score in scores:
+            if score["label"] not in totals:
+                labels.append(score["label"])
+                totals[score["label"]] = 0.0
+            totals[score["label"]] += score["score"] * weight
+
+    return {
+        "aggregate": [{"label": label, "score": totals[label] / total_tokens} for label in labels],
+        "chunks": [
+            {"text": text, "tokens": tokens, "scores": scores}
+            for (text, tokens), scores in zip(chunks, results)
+        ],
+    }
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+import numpy as np
+from stroke_format import StrokeFormatError, points_from_path_data
+
+# which points of the concatenated (n, 2) points to keep so no stroke moves
+# by more than tolerance (ramer douglas peucker). ends are the exclusive end
+# index of every stroke. all strokes are split one level at a time together,
+# so the work per level is a handful of numpy calls over every open segment
+def rdp_keep(points, ends, tolerance):
+    points = np.asarray(points, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.int64)
+    starts = np.concatenate(([0], ends[:-1])) if len(ends) else ends
+    keep = np.zeros(len(points), dtype=bool)
+    non_empty = ends > starts
+    keep[starts[non_empty]] = True
+    keep[ends[non_empty] - 1] = True
+
+    # segments still to check, as first and last point index
+    first = starts[non_empty]
+    last = ends[non_empty] - 1
+    open_segments = last - first >= 2
+    first, last = first[open_segments], last[open_segments]
+    while len(first):
+        inner = last - first - 1
+        segment = np.repeat(np.arange(len(first)), inner)
+        offsets = np.concatenate(([0], np.cumsum(inner)[:-1]))
+        index = np.arange(len(segment)) - offsets[segment] + first[segment] + 1
+
+        a = points[first][segment]
+        direction = points[last][segment] - a
+        relative = points[index] - a
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        cross = np.abs(direction[:, 0] * relative[:, 1] - direction[:, 1] * relative[:, 0])
+        # a stroke that comes back to where it started measures from that point
+        distance = np.where(length > 0, cross / np.where(length > 0, length, 1),
+                            np.hypot(relative[:, 0], relative[:, 1]))
+
+        farthest = np.maximum.reduceat(distance, offsets)
+        split = farthest > tolerance
+        if not split.any():
+            break
+        # first point of every segment that reaches its segment's maximum
+        at_max = np.flatnonzero(distance == farthest[segment])
+        _, first_hit = np.unique(segment[at_max], return_index=True)
+        middle = index[at_max[first_hit]][split]
+        keep[middle] = True
+
+        first = np.concatenate((first[split], middle))
+        last = np.concatenate((middle, last[split]))
+        open_segments = last - first >= 2
+        first, last = first[open_segments], last[open_segments]
+    return keep
+
+# simplifies the strokes of incoming pages before they are hashed, drawn,
+# ocr'd or put in a latex figure, and keeps count of how many points it saved.
+# tolerance is in page units, which are output pixels for the ocr raster
+class StrokeSimplifier:
+    def __init__(self, tolerance=0.5):
+        self.tolerance = tolerance
+        self.pages = 0
+        self.strokes = 0
+        self.points_in = 0
+        self.points_out = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    # copy of paths with every simplified stroke as 'points' instead of
+    # 'data'. text, and path data that isn't a single polyline, stay as they are
+    def simplify(self, paths):
+        if self.tolerance <= 0 or not isinstance(paths, list):
+            return paths
+        start = time.perf_counter()
+        strokes = []
+        runs = []
+        for i, path_info in enumerate(paths):
+            if not isinstance(path_info, dict) or path_info.get("type") == "text":
+                continue
+            points = path_info.get("points")
+            if points is None:
+                try:
+                    points = points_from_path_data(path_info.get("data", ""))
+                except (StrokeFormatError, TypeError, ValueError):
+                    continue
+            strokes.append(i)
+            runs.append(points)
+        if not runs:
+            return paths
+
+        all_points = np.concatenate(runs)
+        lengths = [len(run) for run in runs]
+        keep = rdp_keep(all_points, np.cumsum(lengths), self.tolerance)
+        kept = np.bincount(np.repeat(np.arange(len(runs)), lengths)[keep], minlength=len(runs))
+        simplified_points = np.ascontiguousarray(all_points[keep], dtype=np.float32)
+        # rdp keeps point order, so each stroke's points stay one run
+        kept_ends = np.cumsum(kept).tolist()
+
+        simplified = list(paths)
+        kept_start = 0
+        for i, kept_end in zip(strokes, kept_ends):
+            path_info = dict(paths[i])
+            path_info.pop("data", None)
+            path_info["points"] = simplified_points[kept_start:kept_end]
+            simplified[i] = path_info
+            kept_start = kept_end
+
+        with self.lock:
+            self.pages += 1
+            self.strokes += len(runs)
+            self.points_in += len(all_points)
+            self.points_out += len(simplified_points)
+            self.seconds += time.perf_counter() - start
+        logging.debug(f"Simplified {len(runs)} strokes from {len(all_points)} to {len(simplified_points)} points")
+        return simplified
+
+    def stats(self):
+        with self.lock:
+            return {
+                "tolerance": self.tolerance,
+                "pages": self.pages,
+                "strokes": self.strokes,
+                "points_in": self.points_in,
+                "points_out": self.points_out,
+                "reduction": 1 - self.points_out / self.points_in if self.points_in else 0.0,
+                "seconds": self.seconds,
+            }
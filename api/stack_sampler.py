@@ -0,0 +1,44 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+# samples the stack of every thread at a fixed interval and counts them in
+# the collapsed format flamegraph.pl and speedscope read: one line per stack,
+# frames root first separated by ';', then the number of samples
+class StackSampler:
+    def __init__(self, max_seconds=60):
+        self.max_seconds = max_seconds
+        # only one profile at a time, sampling is not free
+        self.lock = threading.Lock()
+
+    # blocks for seconds, returns None if another profile is already running
+    def sample(self, seconds, interval=0.005):
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(min(seconds, self.max_seconds), interval)
+        finally:
+            self.lock.release()
+
+    def _sample(self, seconds, interval):
+        me = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+        return stacks
+
+def collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
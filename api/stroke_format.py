@@ -0,0 +1,227 @@
+import hashlib
+import json
+import re
+import struct
+import numpy as np
+
+# compact alternative to the json page payload. instead of svg path strings
+# every stroke is a run of float32 x, y pairs, read straight out of the
+# request body with numpy. little endian throughout:
+#
+#   header       magic "SPK1", u16 colors, u16 reserved, u32 strokes,
+#                u32 text bytes, u32 meta bytes, f32 minx, miny, width, height
+#   stroke table one STROKE_DTYPE record per stroke
+#   points       f32 x, y for every point of every stroke, in stroke order
+#   colors       u8 length + utf-8 name for each color the strokes index
+#   text         utf-8 contents of the text strokes, in stroke order
+#   meta         utf-8 json object with the request's other fields
+#                (sessionId, ocrData, options, ...), may be empty
+#
+# a text stroke has two points, its x, y anchor and the bottom right corner of
+# its laid out text, so its bounds travel with it like they do in json
+CONTENT_TYPE = "application/x-smartpen-strokes"
+MAGIC = b"SPK1"
+HEADER = struct.Struct("<4sHHIII4f")
+STROKE_DTYPE = np.dtype([
+    ("points", "<u4"),
+    ("stroke_size", "<f4"),
+    ("color", "<u2"),
+    ("flags", "u1"),
+    ("reserved", "u1"),
+    ("text_bytes", "<u4"),
+])
+FLAG_ERASE = 1
+FLAG_TEXT = 2
+
+# the app's strokes: absolute moveto then linetos, "M12,30L13,31..." or, as
+# the pen sends them, with the linetos implied "M12,30 13,31 ..."
+POLYLINE_TOKEN = re.compile(r'([ML]?)\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)[\s,]+([-+]?[\d.]+(?:[eE][-+]?\d+)?)')
+
+class StrokeFormatError(ValueError):
+    pass
+
+def _text(data, what):
+    try:
+        return bytes(data).decode("utf-8")
+    except UnicodeDecodeError:
+        raise StrokeFormatError(f"{what} is not valid utf-8")
+
+def _bounds(x0, y0, x1, y1):
+    return {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0}
+
+# the request body as (paths, viewbox, meta). paths look like the json ones
+# except strokes carry a read only (n, 2) float32 'points' view into body
+# instead of 'data', and their bounds are worked out from the points
+def decode(body):
+    if len(body) < HEADER.size:
+        raise StrokeFormatError("Stroke data shorter than its header")
+    magic, color_count, _, stroke_count, text_size, meta_size, minx, miny, width, height = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise StrokeFormatError("Not smartpen stroke data")
+
+    offset = HEADER.size
+    table_size = stroke_count * STROKE_DTYPE.itemsize
+    if len(body) < offset + table_size:
+        raise StrokeFormatError("Stroke table truncated")
+    table = np.frombuffer(body, dtype=STROKE_DTYPE, count=stroke_count, offset=offset)
+    offset += table_size
+
+    counts = table["points"].astype(np.int64)
+    total_points = int(counts.sum())
+    if len(body) < offset + total_points * 8:
+        raise StrokeFormatError("Stroke points truncated")
+    points = np.frombuffer(body, dtype="<f4", count=total_points * 2, offset=offset).reshape(-1, 2)
+    offset += total_points * 8
+
+    colors = []
+    for _ in range(color_count):
+        if offset >= len(body):
+            raise StrokeFormatError("Color table truncated")
+        length = body[offset]
+        colors.append(_text(body[offset + 1:offset + 1 + length], "Color name"))
+        offset += 1 + length
+    if len(table) and int(table["color"].max()) >= max(len(colors), 1):
+        raise StrokeFormatError("Stroke color index out of range")
+    if int(table["text_bytes"].sum()) != text_size:
+        raise StrokeFormatError("Text lengths don't add up to the text block")
+    if len(body) != offset + text_size + meta_size:
+        raise StrokeFormatError("Stroke data has the wrong length")
+
+    text = bytes(body[offset:offset + text_size])
+    offset += text_size
+    meta = {}
+    if meta_size:
+        try:
+            meta = json.loads(_text(body[offset:offset + meta_size], "Stroke metadata"))
+        except json.JSONDecodeError:
+            raise StrokeFormatError("Stroke metadata is not valid JSON")
+    if not isinstance(meta, dict):
+        raise StrokeFormatError("Stroke metadata must be a JSON object")
+
+    # per stroke min and max in one pass over all points, strokes without
+    # points get empty bounds at the origin like the app gives them
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if stroke_count else counts
+    non_empty = counts > 0
+    low = np.zeros((stroke_count, 2), dtype=np.float32)
+    high = np.zeros((stroke_count, 2), dtype=np.float32)
+    if total_points:
+        low[non_empty] = np.minimum.reduceat(points, starts[non_empty], axis=0)
+        high[non_empty] = np.maximum.reduceat(points, starts[non_empty], axis=0)
+    low = low.tolist()
+    high = high.tolist()
+    start_list = starts.tolist()
+
+    paths = []
+    text_offset = 0
+    for i, record in enumerate(table.tolist()):
+        count, stroke_size, color_index, flags, _, text_length = record
+        start = start_list[i]
+        color = colors[color_index] if colors else "black"
+        bounds = _bounds(low[i][0], low[i][1], high[i][0], high[i][1])
+        if flags & FLAG_TEXT:
+            if count < 1:
+                raise StrokeFormatError("Text stroke without an anchor point")
+            x, y = points[start].tolist()
+            paths.append({
+                "type": "text",
+                "data": _text(text[text_offset:text_offset + text_length], "Text stroke"),
+                "x": x,
+                "y": y,
+                "color": color,
+                "strokeSize": stroke_size,
+                "bounds": bounds,
+            })
+            text_offset += text_length
+        else:
+            paths.append({
+                "type": "path",
+                "points": points[start:start + count],
+                "erase": bool(flags & FLAG_ERASE),
+                "color": color,
+                "strokeSize": stroke_size,
+                "bounds": bounds,
+            })
+
+    viewbox = {"minx": minx, "miny": miny, "width": width, "height": height}
+    return paths, viewbox, meta
+
+# inverse of decode. strokes need 'points' or polyline 'data', text strokes
+# use their bounds for the second point
+def encode(paths, viewbox, meta=None):
+    colors = []
+    color_index = {}
+    table = np.zeros(len(paths), dtype=STROKE_DTYPE)
+    point_runs = []
+    texts = []
+    for i, path_info in enumerate(paths):
+        color = path_info.get("color", "black")
+        if color not in color_index:
+            color_index[color] = len(colors)
+            colors.append(color)
+        flags = 0
+        if path_info.get("type") == "text":
+            flags |= FLAG_TEXT
+            x = float(path_info.get("x", 0))
+            y = float(path_info.get("y", 0))
+            bounds = path_info.get("bounds") or {}
+            points = np.array([[x, y], [x + float(bounds.get("width", 0)), y + float(bounds.get("height", 0))]], dtype="<f4")
+            content = str(path_info.get("data", "")).encode("utf-8")
+            texts.append(content)
+            table["text_bytes"][i] = len(content)
+        else:
+            if path_info.get("erase", "false"):
+                flags |= FLAG_ERASE
+            points = path_info.get("points")
+            if points is None:
+                points = points_from_path_data(path_info.get("data", ""))
+            points = np.asarray(points, dtype="<f4").reshape(-1, 2)
+        table["points"][i] = len(points)
+        table["stroke_size"][i] = float(path_info.get("strokeSize", 1))
+        table["color"][i] = color_index[color]
+        table["flags"][i] = flags
+        point_runs.append(points)
+
+    names = [color.encode("utf-8") for color in colors]
+    if any(len(name) > 255 for name in names):
+        raise StrokeFormatError("Color names are limited to 255 bytes")
+    color_table = b"".join(bytes([len(name)]) + name for name in names)
+    text = b"".join(texts)
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8") if meta else b""
+    header = HEADER.pack(MAGIC, len(colors), 0, len(paths), len(text), len(meta_bytes),
+                         *(float(viewbox[k]) for k in ("minx", "miny", "width", "height")))
+    points = np.concatenate(point_runs) if point_runs else np.zeros((0, 2), dtype="<f4")
+    return b"".join([header, table.tobytes(), points.tobytes(), color_table, text, meta_bytes])
+
+# points of an app stroke, raises StrokeFormatError for anything but a
+# single M/L polyline
+def points_from_path_data(path_data):
+    # plain numbers after a single M need no regex, anything else falls
+    # through to the full parse for its error message
+    if path_data.startswith("M"):
+        try:
+            values = np.array(path_data[1:].replace("L", " ").replace(",", " ").split(), dtype=np.float32)
+        except ValueError:
+            values = None
+        if values is not None and len(values) % 2 == 0 and np.isfinite(values).all():
+            return values.reshape(-1, 2)
+    matches = POLYLINE_TOKEN.findall(path_data)
+    if POLYLINE_TOKEN.sub("", path_data).strip():
+        raise StrokeFormatError(f"Only polyline path data can be packed: {path_data[:40]}")
+    if matches and (matches[0][0] != "M" or any(command == "M" for command, _, _ in matches[1:])):
+        raise StrokeFormatError(f"Path data must be one stroke starting with a moveto: {path_data[:40]}")
+    return np.array([(float(x), float(y)) for _, x, y in matches], dtype=np.float32).reshape(-1, 2)
+
+# svg path data for a stroke, built from its points if it came in binary
+def path_data(path_info):
+    points = path_info.get("points")
+    if points is None:
+        return path_info.get("data", "")
+    coords = points.tolist()
+    return "".join(f"{'L' if i else 'M'}{x:g},{y:g}" for i, (x, y) in enumerate(coords))
+
+# stands in for the path data when hashing a page, without formatting points as text
+def path_identity(path_info):
+    points = path_info.get("points")
+    if points is None:
+        return path_info.get("data", "")
+    return "points:" + hashlib.sha1(np.ascontiguousarray(points)).hexdigest()
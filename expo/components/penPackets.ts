@@ -0,0 +1,85 @@
+// Decoder for the pen's binary position packets, see hardware/ble_packets.py
+// for the layout
+
+export const PACKET_VERSION = 1;
+const HEADER_SIZE = 8;
+const BASE64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+
+export interface PenPoint {
+    timestamp: number;
+    x: number;
+    y: number;
+    newStroke: boolean;
+}
+
+export interface PenPacket {
+    sequence: number;
+    points: PenPoint[];
+}
+
+// characteristic values arrive base64 encoded
+export function base64ToBytes(value: string): Uint8Array {
+    const clean = value.replace(/[^A-Za-z0-9+/]/g, "");
+    const bytes = new Uint8Array(Math.floor(clean.length * 3 / 4));
+    let buffer = 0;
+    let bits = 0;
+    let length = 0;
+    for (const char of clean) {
+        buffer = (buffer << 6) | BASE64.indexOf(char);
+        bits += 6;
+        if (bits >= 8) {
+            bits -= 8;
+            bytes[length++] = (buffer >> bits) & 0xff;
+        }
+    }
+    return bytes.subarray(0, length);
+}
+
+export function isPenPacket(bytes: Uint8Array): boolean {
+    return bytes.length >= HEADER_SIZE && bytes[0] === PACKET_VERSION;
+}
+
+export function decodePenPacket(bytes: Uint8Array): PenPacket {
+    if (!isPenPacket(bytes)) {
+        throw new Error("Not a pen position packet");
+    }
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const sequence = view.getUint16(1, true);
+    let timestamp = view.getUint32(3, true);
+    const count = bytes[7];
+
+    let offset = HEADER_SIZE;
+    const readVarint = () => {
+        let result = 0;
+        let scale = 1;
+        while (true) {
+            if (offset >= bytes.length) {
+                throw new Error("Packet ends inside a number");
+            }
+            const byte = bytes[offset++];
+            result += (byte & 0x7f) * scale;
+            if (!(byte & 0x80)) {
+                return result;
+            }
+            scale *= 128;
+        }
+    };
+    const unzigzag = (n: number) => (n % 2 === 0 ? n / 2 : -(n + 1) / 2);
+
+    const points: PenPoint[] = [];
+    let x = 0;
+    let y = 0;
+    for (let i = 0; i < count; i++) {
+        const delta = readVarint();
+        timestamp += Math.floor(delta / 2);
+        x += unzigzag(readVarint());
+        y += unzigzag(readVarint());
+        points.push({ timestamp, x, y, newStroke: delta % 2 === 1 });
+    }
+    return { sequence, points };
+}
+
+// same "Mx,y x,y " text the pen used to send, so the strokes are built as before
+export function pointsToPathData(points: PenPoint[]): string {
+    return points.map(point => `${point.newStroke ? "M" : ""}${point.x},${point.y} `).join("");
+}
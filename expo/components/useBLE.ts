@@ -1,14 +1,17 @@
-import { useMemo, useState } from "react";
+import { useMemo, useRef, useState } from "react";
 import { PermissionsAndroid, Platform } from "react-native";
 import { BleError, BleManager, Characteristic, Device, Subscription } from "react-native-ble-plx"
 
 import * as ExpoDevice from "expo-device"
 
 import base64 from "react-native-base64"
+import { base64ToBytes, decodePenPacket, isPenPacket, pointsToPathData } from "./penPackets";
 import Constants from "expo-constants";
 
 const DATA_UUID = "00000001-710e-4a5b-8d75-3e5b444bc3cf"
 const DATA_CHARACTERISTIC = "00000002-710e-4a5b-8d75-3e5b444bc3cf"
+// larger packets carry more points per notification, see hardware/ble_packets.py
+const REQUESTED_MTU = 185
 
 // BLE does not work with Expo Go
 const deviceName = "Pen service"
@@ -35,6 +38,7 @@ export default function useBLE(): BluetoothLowEnergyApi {
     const [allDevices, setAllDevices] = useState<Device[]>([]);
     const [connectedDevice, setConnectedDevice] = useState<Device | null>(null);
     const [data, setData] = useState<string>("");
+    const lastSequence = useRef<number | null>(null);
 
     const requestAndroid31Permissions = async () => {
         const bluetoothScanPermission = await PermissionsAndroid.request(
@@ -118,7 +122,8 @@ export default function useBLE(): BluetoothLowEnergyApi {
             return
         }
         try {
-            const deviceConnection = await bleManager.connectToDevice(device.id)
+            const deviceConnection = await bleManager.connectToDevice(device.id, { requestMTU: REQUESTED_MTU })
+            lastSequence.current = null
             setConnectedDevice(deviceConnection);
             await deviceConnection.discoverAllServicesAndCharacteristics();
             bleManager.stopDeviceScan();
@@ -143,6 +148,27 @@ export default function useBLE(): BluetoothLowEnergyApi {
             return
         }
 
+        const bytes = base64ToBytes(characeristic.value)
+        if (isPenPacket(bytes)) {
+            let packet;
+            try {
+                packet = decodePenPacket(bytes)
+            } catch (e) {
+                console.log("Bad pen packet", e)
+                return
+            }
+            if (lastSequence.current !== null) {
+                const lost = (packet.sequence - lastSequence.current - 1 + 0x10000) % 0x10000
+                if (lost > 0) {
+                    console.log(`Lost ${lost} pen packets`)
+                }
+            }
+            lastSequence.current = packet.sequence
+            const pathData = pointsToPathData(packet.points)
+            setData((oldData) => oldData + pathData)
+            return
+        }
+
         const rawData = base64.decode(characeristic.value)
         setData((oldData) => {
             if (rawData.charAt(0) == "M") {
@@ -33,14 +33,23 @@ export default function LatexPlugin(): PlugInfo {
         return;
       }
 
-      setLoading(true);
-      fetch(`${process.env.EXPO_PUBLIC_SERVER_URL}/latex_plugin`, {
+      const post = (body: {}) => fetch(`${process.env.EXPO_PUBLIC_SERVER_URL}/latex_plugin`, {
         method: "POST",
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ 'ocrData': ocrData, 'options': [], 'svg_paths': svg_paths })
-      })
+        body: JSON.stringify(body)
+      });
+      const fullBody = { 'ocrData': ocrData, 'options': [], 'svg_paths': svg_paths };
+
+      setLoading(true);
+      // the server still has the strokes of a processed page, the ocr text
+      // is sent anyway since it may have been edited
+      (data["documentId"]
+        ? post({ 'document_id': data["documentId"], 'ocrData': ocrData, 'options': [] })
+          // the server forgot the page, send it all
+          .then(response => response.status == 404 ? post(fullBody) : response)
+        : post(fullBody))
         .then(response => {
           return response.blob();
         })
@@ -1,5 +1,5 @@
 import { Ionicons } from "@expo/vector-icons";
-import React, { ComponentType, useMemo } from "react";
+import React, { ComponentType, useEffect, useMemo } from "react";
 import { useCallback, useState } from "react";
 import { FlatList, ListRenderItemInfo, Modal, ScrollView, Text, TextInput, TouchableOpacity, View } from "react-native";
 import { useSafeAreaInsets } from "react-native-safe-area-context";
@@ -57,6 +57,8 @@ export default function PluginManager({ visible, closeModal, annotations }: Plug
   const [plugData, setPlugData] = useState<{}>({});
   const [ocrData, setOcrData] = useState<{ labels: string[], quadBoxes: number[] }>({ labels: [], quadBoxes: [] });
   const [ocrEdited, setOcrEdited] = useState<boolean>(false);
+  // server side copy of the page last sent to /process_svg, plugins send this instead of the strokes
+  const [documentId, setDocumentId] = useState<string | null>(null);
   const insets = useSafeAreaInsets();
   const padding = 500;
   const { settings } = useSettings();
@@ -133,6 +135,11 @@ export default function PluginManager({ visible, closeModal, annotations }: Plug
     return { "viewbox": maxBounds, "svgPaths": jsonAnno }
   }, [annotations]);
 
+  // the stored document no longer matches once the page changes
+  useEffect(() => {
+    setDocumentId(null);
+  }, [jsonAnnotations]);
+
   const makeParagraph = (para: string, color: string, size: number) => {
     const textStyle = {
       color: Skia.Color(color),
@@ -145,16 +152,24 @@ export default function PluginManager({ visible, closeModal, annotations }: Plug
   }
 
   const refreshPlugins = async () => {
+    // state set by getData only shows up on the next render, use what it returns
+    let ocr = ocrData;
+    let id = documentId;
     if (!ocrEdited) {
-      await getData();
+      const result = await getData();
+      if (result) {
+        ocr = result.ocr;
+        id = result.documentId;
+      }
     }
-    setPlugData({ ocr: ocrData, svgData: jsonAnnotations })
+    setPlugData({ ocr: ocr, svgData: jsonAnnotations, documentId: id })
   }
 
   const getData = async () => {
     // Make server request
+    let result: { ocr: typeof ocrData, documentId: string | null } | null = null;
     try {
-      fetch(`${process.env.EXPO_PUBLIC_SERVER_URL}/process_svg`, {
+      result = await fetch(`${process.env.EXPO_PUBLIC_SERVER_URL}/process_svg`, {
         method: "POST",
         headers: {
           'Content-Type': 'application/json',
@@ -171,15 +186,15 @@ export default function PluginManager({ visible, closeModal, annotations }: Plug
               return label.replace(/<\/?s>/g, '');
             });
           }
-          return processData;
-        })
-        .then(ocrResult => {
-          setOcrData(ocrResult);
-        })
+          return { ocr: processData, documentId: data["document_id"] ?? null };
+        });
+      setDocumentId(result.documentId);
+      setOcrData(result.ocr);
     } catch (error) {
       console.error(error);
     }
     setOcrEdited(false);
+    return result;
   };
 
   const renderListItem = useCallback(
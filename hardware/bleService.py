@@ -2,6 +2,7 @@ import sys
 import logging
 import asyncio
 import threading
+import time
 
 from typing import Any, Union
 
@@ -11,15 +12,36 @@ from bless import (  # type: ignore
     GATTCharacteristicProperties,
     GATTAttributePermissions,
 )
-import numpy as np
-import cv2 as cv
 import argparse
 from picamera2 import Picamera2
-from undistort import undistort
+from undistort import GrayFrames
+from capture import CaptureThread, FrameRing
+from recording import FrameRecorder
+from tracker import ENGINES, make_tracker, reported_point
+from ble_packets import PacketEncoder
 
 #logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(name=__name__)
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--no-undistort", dest="undistort", action="store_false",
+                    help="track on the raw fisheye frames")
+parser.add_argument("--engine", choices=sorted(ENGINES), default="lk",
+                    help="motion estimator, compare them on a recording with replay.py")
+# bless doesn't tell us the MTU the central negotiated, so packets are sized
+# for the 23 byte MTU every connection starts with unless told otherwise.
+# a larger --mtu than the central agreed to gets notifications truncated
+parser.add_argument("--mtu", type=int, default=23,
+                    help="ATT MTU to fill packets up to, only raise it for centrals known to "
+                         "negotiate at least this much (the app asks for 185)")
+parser.add_argument("--flush-ms", type=float, default=30,
+                    help="longest a point waits for its packet to fill up")
+parser.add_argument("--record", metavar="DIR",
+                    help="also save the raw camera frames here for replay.py")
+parser.add_argument("--record-frames", type=int, default=1800,
+                    help="frames to record before recording stops")
+args = parser.parse_args()
+
 # NOTE: Some systems require different synchronization methods.
 trigger: Union[asyncio.Event, threading.Event]
 trigger = asyncio.Event()
@@ -35,6 +57,27 @@ def write_request(characteristic: BlessGATTCharacteristic, value: Any, **kwargs)
     trigger.set()
 
 
+# runs the tracker on the newest frame until the ring closes, report(point)
+# gets (timestamp in ms, x, y) every time the pen is still and None when tracking ends
+def track(ring, tracker, report, log_every=5.0):
+    last_log = time.monotonic()
+    while True:
+        latest = ring.latest()
+        if latest is None:
+            # camera stopped, let the BLE loop know
+            report(None)
+            break
+        _, timestamp, gray = latest
+        point = reported_point(tracker, tracker.update(gray))
+        if point is not None:
+            report((int(timestamp * 1000), *point))
+        now = time.monotonic()
+        if now - last_log >= log_every:
+            stats = ring.stats()
+            logger.info(f"tracked {stats['read']} of {stats['written']} frames, {stats['dropped']} dropped")
+            last_log = now
+
+
 async def run(loop):
     trigger.clear()
     # Instantiate the server
@@ -54,6 +97,8 @@ async def run(loop):
         GATTCharacteristicProperties.read
         | GATTCharacteristicProperties.write
         | GATTCharacteristicProperties.indicate
+        # notifications aren't acknowledged, several packets can go out per connection event
+        | GATTCharacteristicProperties.notify
     )
     permissions = GATTAttributePermissions.readable | GATTAttributePermissions.writeable
     await server.add_new_characteristic(
@@ -63,7 +108,6 @@ async def run(loop):
     logger.debug(server.get_characteristic(my_char_uuid))
     await server.start()
     logger.debug("Advertising")
-    message = "M"
 
     while not await server.is_connected():
         await asyncio.sleep(1)
@@ -77,71 +121,73 @@ async def run(loop):
     picam2.start()
 
 
-    # params for ShiTomasi corner detection
-    feature_params = dict( maxCorners = 50,
-                           qualityLevel = 0.3,
-                           minDistance = 7,
-                           blockSize = 7 )
-    # Parameters for lucas kanade optical flow
-    lk_params = dict( winSize  = (15, 15),
-                      maxLevel = 2,
-                      criteria = (cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 10, 0.03))
-
-    # Take first frame and find corners in it
+    # Take first frame to learn its size
     old_frame = picam2.capture_array()
     print(old_frame.shape)
-    #old_frame = undistort(old_frame)
-    old_gray = cv.cvtColor(old_frame, cv.COLOR_BGR2GRAY)
-    p0 = cv.goodFeaturesToTrack(old_gray, mask = None, **feature_params)
-    # Create a mask image for drawing purposes
-    mask = np.zeros_like(old_frame)
-
-    pos = np.array([mask.shape[1] / 2, mask.shape[0]/2])
-
-
-    while(1):
-        frame = picam2.capture_array()
-        #frame = undistort(frame)
-        frame_gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-        # calculate optical flow
-        if p0 is not None:
-            p1, st, err = cv.calcOpticalFlowPyrLK(old_gray, frame_gray, p0, None, **lk_params)
-            # Select good points
-            if p1 is not None:
-                good_new = p1[st==1]
-                good_old = p0[st==1]
-            if good_new.shape[0] > 0:
-                # draw the tracks
-                avg=np.average(good_new - good_old, axis = 0)
-                pos=pos+avg
-                if(avg[0] < 0.01 and avg[1] < 0.01):
-                    message += str(int(pos[0]/3)) + "," + str(int(pos[1]/3)) + " "
-        await asyncio.sleep(0.001)
-
-        # Now update the previous frame and previous points
-        old_gray = frame_gray.copy()
-        if good_new.shape[0] != p1.shape[0] or good_new.shape[0] < 7:
-            p0 = cv.goodFeaturesToTrack(old_gray, mask = None, **feature_params)
-        else:
-            p0 = good_new.reshape(-1, 1, 2)
-            await asyncio.sleep(1)
-        if len(message) > 20:
-            b = bytearray()
-            b.extend(map(ord, message[0:20]))
-            server.get_characteristic(my_char_uuid).value = b
-            server.get_characteristic(my_char_uuid)
-            server.update_value(my_service_uuid, "00000002-710e-4a5b-8d75-3e5b444bc3cf")
-            message = message[20:]
-        k = cv.waitKey(1) & 0xff
-        if k == 27:
-            break
-        elif k == ord('c'):
-            pos = np.array([mask.shape[1]/2, mask.shape[0]/2])
-            
-
+    size = (old_frame.shape[1], old_frame.shape[0])
+
+    # the camera thread undistorts and converts every frame to gray straight
+    # into the ring, the tracker thread always works on the newest one and
+    # this loop only talks BLE
+    frames = GrayFrames(size, undistort=args.undistort)
+    ring = FrameRing((size[1], size[0]))
+    recorder = FrameRecorder(args.record, size, args.record_frames) if args.record else None
+    capture = CaptureThread(picam2.capture_array, ring, frames.convert, recorder)
+    positions = asyncio.Queue()
+    tracking = threading.Thread(
+        target=track,
+        args=(ring, make_tracker(args.engine, size), lambda point: loop.call_soon_threadsafe(positions.put_nowait, point)),
+        name="tracker",
+        daemon=True,
+    )
+    capture.start()
+    tracking.start()
+
+    def send(packets):
+        for packet in packets:
+            server.get_characteristic(my_char_uuid).value = bytearray(packet)
+            server.update_value(my_service_uuid, my_char_uuid)
+
+    try:
+        # points are batched into binary packets, a packet goes out once it is
+        # full or its first point has waited flush_ms
+        encoder = PacketEncoder(args.mtu)
+        new_stroke = True
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                point = await asyncio.wait_for(positions.get(), timeout)
+            except asyncio.TimeoutError:
+                send(encoder.flush())
+                deadline = None
+                continue
+            if point is None:
+                break
+            timestamp, x, y = point
+            packets = encoder.add(timestamp, x, y, new_stroke)
+            send(packets)
+            new_stroke = False
+            # the point either joined the waiting packet or started a new one
+            if packets or deadline is None:
+                deadline = loop.time() + args.flush_ms / 1000
+        send(encoder.flush())
+    finally:
+        # also when interrupted, so the recording is left readable
+        capture.stop()
+        picam2.stop()
+        if recorder is not None:
+            recorder.close()
     await asyncio.sleep(5)
     await server.stop()
 
 
 loop = asyncio.get_event_loop()
-loop.run_until_complete(run(loop))
+main = loop.create_task(run(loop))
+try:
+    loop.run_until_complete(main)
+except KeyboardInterrupt:
+    # ctrl-c while the loop waits leaves run() suspended, cancel it so its
+    # cleanup runs
+    main.cancel()
+    loop.run_until_complete(asyncio.gather(main, return_exceptions=True))
@@ -0,0 +1,162 @@
+# binary pen position packets for the BLE characteristic. each packet is one
+# notification, filled with as many points as fit in the negotiated MTU:
+#
+#   header   u8 version, u16 sequence, u32 timestamp of the first point in ms,
+#            u8 point count (little endian)
+#   points   varint (ms since previous point << 1 | new stroke flag),
+#            zigzag varint dx, zigzag varint dy
+#
+# the first point of every packet is relative to 0, 0 and the header
+# timestamp, so a lost packet only loses its own points. sequence numbers
+# let the receiver count lost packets. expo/components/penPackets.ts is the
+# app side of this
+import struct
+
+PACKET_VERSION = 1
+HEADER = struct.Struct("<BHIB")
+# bytes of every notification taken by the ATT protocol itself
+ATT_OVERHEAD = 3
+MAX_POINTS = 255
+
+def zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+def unzigzag(n):
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def read_varint(data, offset):
+    result = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("Packet ends inside a number")
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, offset
+        shift += 7
+
+# batches points into packets no larger than mtu - ATT_OVERHEAD bytes
+class PacketEncoder:
+    def __init__(self, mtu=23):
+        self.payload_size = mtu - ATT_OVERHEAD
+        if self.payload_size < HEADER.size + 9:
+            raise ValueError(f"MTU {mtu} is too small for a position packet")
+        self.sequence = 0
+        self.body = bytearray()
+        self.count = 0
+        self.first_timestamp = 0
+        self.last = None
+
+    # queue a point (timestamp in ms, integer x and y), returns the packets
+    # that filled up because of it
+    def add(self, timestamp, x, y, new_stroke=False):
+        timestamp = int(timestamp)
+        point = self._encode(timestamp, x, y, new_stroke)
+        if self.count and (HEADER.size + len(self.body) + len(point) > self.payload_size or self.count == MAX_POINTS):
+            packets = self.flush()
+            point = self._encode(timestamp, x, y, new_stroke)
+        else:
+            packets = []
+        if not self.count:
+            self.first_timestamp = timestamp
+        self.body += point
+        self.count += 1
+        self.last = (timestamp, x, y)
+        return packets
+
+    # the partly filled packet, if there is one
+    def flush(self):
+        if not self.count:
+            return []
+        packet = HEADER.pack(PACKET_VERSION, self.sequence, self.first_timestamp & 0xffffffff, self.count) + self.body
+        self.sequence = (self.sequence + 1) & 0xffff
+        self.body = bytearray()
+        self.count = 0
+        self.last = None
+        return [bytes(packet)]
+
+    def _encode(self, timestamp, x, y, new_stroke):
+        if self.count:
+            last_timestamp, last_x, last_y = self.last
+        else:
+            last_timestamp, last_x, last_y = timestamp, 0, 0
+        out = bytearray()
+        write_varint(out, (max(timestamp - last_timestamp, 0) << 1) | int(new_stroke))
+        write_varint(out, zigzag(x - last_x))
+        write_varint(out, zigzag(y - last_y))
+        return out
+
+# turns packets back into points and keeps count of the ones that never arrived
+class PacketDecoder:
+    def __init__(self):
+        self.expected = None
+        self.received = 0
+        self.lost = 0
+
+    # list of (timestamp in ms, x, y, new stroke) for one packet
+    def decode(self, packet):
+        if len(packet) < HEADER.size:
+            raise ValueError("Packet shorter than its header")
+        version, sequence, timestamp, count = HEADER.unpack_from(packet)
+        if version != PACKET_VERSION:
+            raise ValueError(f"Unknown packet version {version}")
+
+        points = []
+        offset = HEADER.size
+        x = y = 0
+        for _ in range(count):
+            delta, offset = read_varint(packet, offset)
+            dx, offset = read_varint(packet, offset)
+            dy, offset = read_varint(packet, offset)
+            timestamp += delta >> 1
+            x += unzigzag(dx)
+            y += unzigzag(dy)
+            points.append((timestamp, x, y, bool(delta & 1)))
+        if offset != len(packet):
+            raise ValueError("Packet has bytes after its last point")
+
+        if self.expected is not None:
+            self.lost += (sequence - self.expected) & 0xffff
+        self.expected = (sequence + 1) & 0xffff
+        self.received += 1
+        return points
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    parser = argparse.ArgumentParser(description="bytes per point of the binary packets against the old ascii messages")
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--mtu", type=int, default=185)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    points = []
+    timestamp, x, y = 0, 200, 150
+    for i in range(args.points):
+        timestamp += rng.randint(8, 40)
+        x += rng.randint(-3, 3)
+        y += rng.randint(-3, 3)
+        points.append((timestamp, x, y, i % 200 == 0))
+
+    encoder = PacketEncoder(args.mtu)
+    packets = []
+    for point in points:
+        packets += encoder.add(*point)
+    packets += encoder.flush()
+
+    decoder = PacketDecoder()
+    decoded = [point for packet in packets for point in decoder.decode(packet)]
+    assert decoded == points, "round trip changed the points"
+
+    ascii_bytes = len("M" + "".join(f"{x},{y} " for _, x, y, _ in points))
+    binary_bytes = sum(len(packet) for packet in packets)
+    print(f"ascii: {ascii_bytes / len(points):.2f} bytes/point in {-(-ascii_bytes // 20)} notifications of 20 bytes")
+    print(f"binary: {binary_bytes / len(points):.2f} bytes/point in {len(packets)} notifications (mtu {args.mtu})")
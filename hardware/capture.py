@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+from collections import deque
+import numpy as np
+
+logger = logging.getLogger(name=__name__)
+
+# fixed set of preallocated frames shared by one writer (the camera) and one
+# reader (the tracker). the writer never waits: it fills whichever slot is
+# neither the newest frame nor held by the reader, so a slow reader just
+# skips frames. the reader always gets the newest frame and keeps its last
+# `hold` frames valid, the tracker needs the previous one to compare against
+class FrameRing:
+    def __init__(self, shape, dtype=np.uint8, slots=5, hold=2):
+        if slots < hold + 2:
+            raise ValueError("FrameRing needs room for the held frames, the newest one and one to write")
+        self.frames = [np.empty(shape, dtype=dtype) for _ in range(slots)]
+        self.sequence = [0] * slots
+        self.timestamps = [0.0] * slots
+        self.newest = None
+        self.held = deque(maxlen=hold)
+        self.written = 0
+        self.read = 0
+        self.dropped = 0
+        self.last_read = 0
+        self.closed = False
+        self.changed = threading.Condition()
+
+    # slot and array for the next frame, publish it with finish_write
+    def start_write(self):
+        with self.changed:
+            busy = set(self.held)
+            busy.add(self.newest)
+            start = 0 if self.newest is None else self.newest + 1
+            for offset in range(len(self.frames)):
+                slot = (start + offset) % len(self.frames)
+                if slot not in busy:
+                    return slot, self.frames[slot]
+        raise RuntimeError("No free frame slot")
+
+    def finish_write(self, slot, timestamp):
+        with self.changed:
+            self.written += 1
+            self.sequence[slot] = self.written
+            self.timestamps[slot] = timestamp
+            self.newest = slot
+            self.changed.notify_all()
+
+    # wait for a frame newer than the last one read and return
+    # (sequence, timestamp, frame), or None once the ring is closed. frames
+    # the writer published in between are counted as dropped
+    def latest(self, timeout=None):
+        with self.changed:
+            if not self.changed.wait_for(lambda: self.closed or self.written > self.last_read, timeout):
+                return None
+            if self.closed:
+                return None
+            slot = self.newest
+            sequence = self.sequence[slot]
+            self.dropped += sequence - self.last_read - 1
+            self.last_read = sequence
+            self.read += 1
+            self.held.append(slot)
+            return sequence, self.timestamps[slot], self.frames[slot]
+
+    def close(self):
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def stats(self):
+        with self.changed:
+            return {"written": self.written, "read": self.read, "dropped": self.dropped}
+
+# pulls frames from capture() as fast as the camera delivers them and writes
+# them into the ring through convert(frame, out). raw frames are also handed
+# to recorder.write(frame, timestamp) when one is given, see recording.py
+class CaptureThread(threading.Thread):
+    def __init__(self, capture, ring, convert, recorder=None):
+        super().__init__(name="capture", daemon=True)
+        self.capture = capture
+        self.ring = ring
+        self.convert = convert
+        self.recorder = recorder
+        self.running = True
+
+    def run(self):
+        try:
+            while self.running:
+                frame = self.capture()
+                timestamp = time.monotonic()
+                if self.recorder is not None:
+                    self.recorder.write(frame, timestamp)
+                slot, out = self.ring.start_write()
+                self.convert(frame, out)
+                self.ring.finish_write(slot, timestamp)
+        except Exception:
+            logger.exception("Camera capture stopped")
+        finally:
+            self.ring.close()
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,72 @@
+# frames per second of the tracker's preprocessing with and without
+# undistortion, on generated frames so it runs anywhere. run on the pi:
+#   python preprocess_benchmark.py --frames 300
+import argparse
+import time
+import numpy as np
+import cv2 as cv
+from undistort import K, D, GrayFrames, undistort
+
+# random paper-like texture so remap does real work
+def synthetic_frames(count, size, seed=0):
+    rng = np.random.default_rng(seed)
+    width, height = size
+    texture = rng.integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+    texture = cv.resize(texture, (width, height), interpolation=cv.INTER_LINEAR)
+    return [np.roll(texture, (i, i), axis=(0, 1)) for i in range(count)]
+
+# what bleService did before: maps rebuilt per frame, three channel remap, gray copy
+def per_frame_maps(frames, size):
+    old_gray = None
+    for frame in frames:
+        map1, map2 = cv.fisheye.initUndistortRectifyMap(K, D, np.eye(3), K, size, cv.CV_16SC2)
+        undistorted = cv.remap(frame, map1, map2, interpolation=cv.INTER_LINEAR, borderMode=cv.BORDER_CONSTANT)
+        frame_gray = cv.cvtColor(undistorted, cv.COLOR_BGR2GRAY)
+        old_gray = frame_gray.copy()
+    return old_gray
+
+def gray_only(frames, size):
+    old_gray = None
+    for frame in frames:
+        frame_gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        old_gray = frame_gray.copy()
+    return old_gray
+
+# cached maps but still remapping all three channels before converting
+def cached_maps(frames, size):
+    old_gray = None
+    for frame in frames:
+        frame_gray = cv.cvtColor(undistort(frame), cv.COLOR_BGR2GRAY)
+        old_gray = frame_gray.copy()
+    return old_gray
+
+def fused(frames, size, undistort_frames=True):
+    gray_frames = GrayFrames(size, undistort=undistort_frames)
+    old_gray = None
+    for frame in frames:
+        old_gray = gray_frames.next(frame)
+    return old_gray
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--size", type=int, nargs=2, default=[640, 480])
+    args = parser.parse_args()
+
+    size = tuple(args.size)
+    frames = synthetic_frames(args.frames, size)
+    routes = [
+        ("maps per frame + remap BGR", per_frame_maps),
+        ("gray only, no undistort", gray_only),
+        ("cached maps + remap BGR", cached_maps),
+        ("fused, no undistort", lambda f, s: fused(f, s, undistort_frames=False)),
+        ("fused gray + cached remap", fused),
+    ]
+    print(f"{'route':>28} {'fps':>9} {'ms/frame':>9}")
+    for name, route in routes:
+        # warm up caches and buffers outside the timing
+        route(frames[:2], size)
+        start = time.perf_counter()
+        route(frames, size)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>28} {len(frames) / elapsed:>9.1f} {elapsed / len(frames) * 1000:>9.3f}")
@@ -0,0 +1,137 @@
+# camera recordings for replaying the tracker without the pen. a recording
+# is a directory with
+#   frames.npy      (max frames, height, width) uint8 gray frames, memory mapped
+#   timestamps.npy  (max frames,) float64 capture time in seconds
+#   recording.json  how many frames were actually written
+# frames are stored before undistortion so a replay can pick either way.
+#   python recording.py record out_dir --frames 600     (on the pen)
+#   python recording.py synthetic out_dir --frames 600  (anywhere)
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+import cv2 as cv
+
+logger = logging.getLogger(name=__name__)
+
+FRAMES_FILE = "frames.npy"
+TIMESTAMPS_FILE = "timestamps.npy"
+META_FILE = "recording.json"
+# frames between metadata updates, a recording that is never closed still
+# opens with all but the last few
+META_EVERY = 60
+
+class FrameRecorder:
+    def __init__(self, path, size, max_frames):
+        width, height = size
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.frames = np.lib.format.open_memmap(os.path.join(path, FRAMES_FILE), mode="w+",
+                                                dtype=np.uint8, shape=(max_frames, height, width))
+        self.timestamps = np.lib.format.open_memmap(os.path.join(path, TIMESTAMPS_FILE), mode="w+",
+                                                    dtype=np.float64, shape=(max_frames,))
+        self.count = 0
+        self.lock = threading.Lock()
+        self._write_meta()
+
+    @property
+    def full(self):
+        return self.count >= len(self.frames)
+
+    # store frame (BGR or already gray), False once the recording is full
+    def write(self, frame, timestamp):
+        with self.lock:
+            if self.full:
+                return False
+            out = self.frames[self.count]
+            if frame.ndim == 2:
+                np.copyto(out, frame)
+            else:
+                cv.cvtColor(frame, cv.COLOR_BGR2GRAY, dst=out)
+            self.timestamps[self.count] = timestamp
+            self.count += 1
+            if self.full:
+                self.frames.flush()
+                self.timestamps.flush()
+                self._write_meta()
+                logger.info(f"Recording {self.path} full after {self.count} frames")
+            elif self.count % META_EVERY == 0:
+                self._write_meta()
+            return True
+
+    def close(self):
+        with self.lock:
+            self.frames.flush()
+            self.timestamps.flush()
+            self._write_meta()
+
+    # replaced in one go so a reader never sees half a file
+    def _write_meta(self):
+        height, width = self.frames.shape[1:]
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"frames": self.count, "width": width, "height": height}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+# (frames, timestamps) of a recording, read only and memory mapped
+def open_recording(path):
+    with open(os.path.join(path, META_FILE)) as f:
+        count = json.load(f)["frames"]
+    frames = np.load(os.path.join(path, FRAMES_FILE), mmap_mode="r")
+    timestamps = np.load(os.path.join(path, TIMESTAMPS_FILE), mmap_mode="r")
+    return frames[:count], timestamps[:count]
+
+# textured paper sliding along a known path. the truth is written next to
+# the frames as trajectory.csv: frame, x, y of how far the tracker should
+# have moved from where it started, in pixels
+def record_synthetic(path, frames, size=(640, 480), fps=60, seed=0):
+    rng = np.random.default_rng(seed)
+    width, height = size
+    margin = 200
+    texture = rng.integers(0, 255, ((height + 2 * margin) // 6, (width + 2 * margin) // 6), dtype=np.uint8)
+    texture = cv.GaussianBlur(cv.resize(texture, (width + 2 * margin, height + 2 * margin)), (5, 5), 0)
+    recorder = FrameRecorder(path, size, frames)
+    truth = []
+    for i in range(frames):
+        t = i / fps
+        # a slow loop like handwriting, in pixels from the center
+        dx = 120 * np.sin(t * 1.3) + 40 * np.sin(t * 4.1)
+        dy = 90 * np.sin(t * 0.9) + 30 * np.cos(t * 3.7)
+        x0 = int(round(margin + dx))
+        y0 = int(round(margin + dy))
+        recorder.write(texture[y0:y0 + height, x0:x0 + width], t)
+        # the camera window moves one way, the picture in it the other
+        truth.append((i, margin - x0, margin - y0))
+    recorder.close()
+    np.savetxt(os.path.join(path, "trajectory.csv"), np.array(truth), fmt="%d", delimiter=",", header="frame,x,y")
+
+def record_camera(path, frames):
+    from picamera2 import Picamera2
+    picam2 = Picamera2()
+    main={'format': 'RGB888', 'size': (640, 480)}
+    sensor = {'output_size': (1920, 1080), 'bit_depth': 10}
+    picam2.configure(picam2.create_preview_configuration(main=main, sensor=sensor))
+    picam2.start()
+    first = picam2.capture_array()
+    recorder = FrameRecorder(path, (first.shape[1], first.shape[0]), frames)
+    try:
+        while recorder.write(picam2.capture_array(), time.monotonic()):
+            pass
+    finally:
+        recorder.close()
+        picam2.stop()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", choices=["record", "synthetic"])
+    parser.add_argument("path")
+    parser.add_argument("--frames", type=int, default=600)
+    args = parser.parse_args()
+    if args.source == "record":
+        record_camera(args.path, args.frames)
+    else:
+        record_synthetic(args.path, args.frames)
@@ -0,0 +1,150 @@
+# runs the tracker over a recording (see recording.py) as fast as it can,
+# without camera, BLE or display, and reports frames per second, time per
+# stage and the trajectory. compare against a trajectory from an earlier run
+# (or the truth of a synthetic recording) to catch tracker regressions:
+#   python recording.py synthetic /tmp/rec --frames 600
+#   python replay.py /tmp/rec --no-undistort --reference /tmp/rec/trajectory.csv
+# several engines can be compared on the same recording with --engine lk phase hybrid
+import argparse
+import json
+import os
+import time
+import numpy as np
+from recording import open_recording
+from undistort import GrayFrames
+from tracker import ENGINES, make_tracker, reported_point
+from ble_packets import PacketEncoder
+
+STAGES = ("preprocess", "track", "report")
+
+# feed every frame through the same steps as bleService. returns the seconds
+# spent per stage and frame, the tracker position and confidence after every
+# frame and what would have gone over BLE
+def replay(frames, timestamps, tracker, undistort=True, mtu=23):
+    height, width = frames.shape[1:]
+    gray_frames = GrayFrames((width, height), undistort=undistort)
+    encoder = PacketEncoder(mtu)
+    timings = np.zeros((len(frames), len(STAGES)))
+    trajectory = np.zeros((len(frames), 2))
+    confidence = np.zeros(len(frames))
+    points = 0
+    packet_bytes = 0
+    new_stroke = True
+    clock = time.perf_counter
+    for i in range(len(frames)):
+        start = clock()
+        gray = gray_frames.next(frames[i])
+        preprocessed = clock()
+        motion = tracker.update(gray)
+        tracked = clock()
+        point = reported_point(tracker, motion)
+        if point is not None:
+            packet_bytes += sum(len(p) for p in encoder.add(int(timestamps[i] * 1000), *point, new_stroke))
+            new_stroke = False
+            points += 1
+        reported = clock()
+        timings[i] = (preprocessed - start, tracked - preprocessed, reported - tracked)
+        trajectory[i] = tracker.pos
+        confidence[i] = tracker.confidence
+    packet_bytes += sum(len(p) for p in encoder.flush())
+    return {"timings": timings, "trajectory": trajectory, "confidence": confidence,
+            "points": points, "packet_bytes": packet_bytes}
+
+def stage_summary(timings):
+    summary = {}
+    for column, stage in enumerate(STAGES + ("total",)):
+        ms = (timings.sum(axis=1) if stage == "total" else timings[:, column]) * 1000
+        summary[stage] = {
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p99_ms": float(np.percentile(ms, 99)),
+        }
+    return summary
+
+def save_trajectory(path, timestamps, trajectory):
+    rows = np.column_stack((np.arange(len(trajectory)), timestamps, trajectory))
+    np.savetxt(path, rows, fmt=("%d", "%.6f", "%.3f", "%.3f"), delimiter=",", header="frame,timestamp,x,y")
+
+# distance between the tracker's movement and a reference trajectory, both
+# taken relative to their first frame. the reference is either a trajectory
+# written by this script (frame,timestamp,x,y) or a synthetic truth (frame,x,y)
+def compare(trajectory, reference_path):
+    reference = np.loadtxt(reference_path, delimiter=",", ndmin=2)
+    frame_numbers = reference[:, 0].astype(int)
+    reference_xy = reference[:, -2:]
+    keep = frame_numbers < len(trajectory)
+    moved = trajectory[frame_numbers[keep]] - trajectory[0]
+    expected = reference_xy[keep] - reference_xy[0]
+    error = np.linalg.norm(moved - expected, axis=1)
+    return {"frames": int(keep.sum()), "mean_px": float(error.mean()), "max_px": float(error.max()),
+            "final_px": float(error[-1])}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording")
+    parser.add_argument("--no-undistort", dest="undistort", action="store_false",
+                        help="track on the raw fisheye frames, like bleService --no-undistort")
+    parser.add_argument("--engine", nargs="+", choices=sorted(ENGINES), default=["lk"],
+                        help="motion estimators to replay, one after the other")
+    parser.add_argument("--mtu", type=int, default=23, help="like bleService --mtu")
+    parser.add_argument("--repeat", type=int, default=1, help="replay this often and keep the fastest run")
+    parser.add_argument("--trajectory", help="write the tracked positions to this csv, "
+                        "the engine name is added when there are several")
+    parser.add_argument("--reference", help="trajectory csv to compare the tracked positions against")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    frames, timestamps = open_recording(args.recording)
+    if not len(frames):
+        parser.error(f"{args.recording} has no frames")
+    # read the whole recording once so the first run doesn't time the disk
+    frames = np.ascontiguousarray(frames)
+    size = (frames.shape[2], frames.shape[1])
+
+    reports = {}
+    for engine in args.engine:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = replay(frames, timestamps, make_tracker(engine, size), undistort=args.undistort, mtu=args.mtu)
+            result["elapsed"] = time.perf_counter() - start
+            if best is None or result["elapsed"] < best["elapsed"]:
+                best = result
+
+        report = {
+            "fps": len(frames) / best["elapsed"],
+            "stages": stage_summary(best["timings"]),
+            "mean_confidence": float(best["confidence"].mean()),
+            "points": best["points"],
+            "packet_bytes": best["packet_bytes"],
+        }
+        if args.trajectory:
+            path = args.trajectory
+            if len(args.engine) > 1:
+                root, ext = os.path.splitext(path)
+                path = f"{root}_{engine}{ext}"
+            save_trajectory(path, timestamps, best["trajectory"])
+        if args.reference:
+            report["reference"] = compare(best["trajectory"], args.reference)
+        reports[engine] = report
+
+    if args.json:
+        print(json.dumps({
+            "recording": os.path.abspath(args.recording),
+            "frames": len(frames),
+            "undistort": args.undistort,
+            "engines": reports,
+        }, indent=2))
+    else:
+        for engine, report in reports.items():
+            print(f"{engine}: {len(frames)} frames at {report['fps']:.1f} fps (undistort {args.undistort})")
+            print(f"{'stage':>12} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+            for stage, summary in report["stages"].items():
+                print(f"{stage:>12} {summary['mean_ms']:>9.3f} {summary['p50_ms']:>9.3f} {summary['p99_ms']:>9.3f}")
+            print(f"{report['points']} points reported in {report['packet_bytes']} packet bytes, "
+                  f"mean confidence {report['mean_confidence']:.2f}")
+            if "reference" in report:
+                reference = report["reference"]
+                print(f"against reference: mean {reference['mean_px']:.2f}px, max {reference['max_px']:.2f}px, "
+                      f"final {reference['final_px']:.2f}px over {reference['frames']} frames")
+            print()
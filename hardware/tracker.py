@@ -0,0 +1,150 @@
+import numpy as np
+import cv2 as cv
+
+# params for ShiTomasi corner detection
+FEATURE_PARAMS = dict( maxCorners = 50,
+                       qualityLevel = 0.3,
+                       minDistance = 7,
+                       blockSize = 7 )
+# Parameters for lucas kanade optical flow
+LK_PARAMS = dict( winSize  = (15, 15),
+                  maxLevel = 2,
+                  criteria = (cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 10, 0.03))
+# fewer tracked corners than this and new ones are searched for
+MIN_POINTS = 7
+
+# pen position to report after a frame, or None. the position is only sent
+# while the pen is (nearly) still, scaled down to the app's coordinates
+def reported_point(tracker, motion):
+    if motion is not None and motion[0] < 0.01 and motion[1] < 0.01:
+        return int(tracker.pos[0]/3), int(tracker.pos[1]/3)
+    return None
+
+# follows the pen across gray frames. pos is the accumulated motion starting
+# from the center and confidence (0 to 1) says how much the last estimate can
+# be trusted. engines only implement estimate(gray), see ENGINES below
+class MotionTracker:
+    def __init__(self, size):
+        self.center = np.array([size[0] / 2, size[1] / 2])
+        self.pos = self.center.copy()
+        self.confidence = 0.0
+
+    def reset(self):
+        self.pos = self.center.copy()
+
+    # the motion since the last frame, None when it couldn't be estimated.
+    # gray has to stay unchanged until the next call, it is compared against then
+    def update(self, gray):
+        motion, self.confidence = self.estimate(gray)
+        if motion is not None:
+            self.pos = self.pos + motion
+        return motion
+
+    # (motion or None, confidence) between the previous frame and gray
+    def estimate(self, gray):
+        raise NotImplementedError
+
+# lucas kanade optical flow on ShiTomasi corners. confidence is the share of
+# corners that could be followed, lower still when there are only a few
+class LKTracker(MotionTracker):
+    def __init__(self, size, lk_params=LK_PARAMS):
+        super().__init__(size)
+        self.lk_params = lk_params
+        self.old_gray = None
+        self.p0 = None
+
+    # guess is an expected motion to start the search from, see HybridTracker
+    def estimate(self, gray, guess=None):
+        motion = None
+        confidence = 0.0
+        good_new = None
+        p1 = None
+        if self.old_gray is not None and self.p0 is not None and len(self.p0):
+            # calculate optical flow
+            if guess is None:
+                p1, st, err = cv.calcOpticalFlowPyrLK(self.old_gray, gray, self.p0, None, **self.lk_params)
+            else:
+                p1 = (self.p0 + np.float32(guess)).astype(np.float32)
+                p1, st, err = cv.calcOpticalFlowPyrLK(self.old_gray, gray, self.p0, p1,
+                                                      flags=cv.OPTFLOW_USE_INITIAL_FLOW, **self.lk_params)
+            # Select good points
+            if p1 is not None:
+                good_new = p1[st==1]
+                good_old = self.p0[st==1]
+                if good_new.shape[0] > 0:
+                    motion = np.average(good_new - good_old, axis = 0)
+                    confidence = good_new.shape[0] / len(self.p0) * min(1.0, good_new.shape[0] / MIN_POINTS)
+
+        # Now update the previous frame and previous points
+        self.old_gray = gray
+        if good_new is None or good_new.shape[0] != p1.shape[0] or good_new.shape[0] < MIN_POINTS:
+            self.p0 = cv.goodFeaturesToTrack(gray, mask = None, **FEATURE_PARAMS)
+        else:
+            self.p0 = good_new.reshape(-1, 1, 2)
+        return motion, confidence
+
+# phase correlation of whole, downsampled frames. needs no corners, so it
+# keeps working on paper with little texture, and costs the same every frame.
+# confidence is the height of the correlation peak. much below half size the
+# sub pixel peak sticks to whole (downsampled) pixels and the position drifts
+class PhaseCorrelationTracker(MotionTracker):
+    # below this the peak is mostly noise and no motion is reported
+    MIN_RESPONSE = 0.1
+
+    def __init__(self, size, scale=0.5):
+        super().__init__(size)
+        self.scale = scale
+        self.small_size = (max(int(size[0] * scale), 8), max(int(size[1] * scale), 8))
+        width, height = self.small_size
+        self.window = cv.createHanningWindow(self.small_size, cv.CV_32F)
+        self.small = np.empty((height, width), dtype=np.uint8)
+        # previous and current downsampled frame take turns
+        self.buffers = [np.empty((height, width), dtype=np.float32) for _ in range(2)]
+        self.current = 0
+        self.primed = False
+
+    # (shift in full frame pixels, peak response), or (None, 0) on the first frame
+    def correlate(self, gray):
+        cv.resize(gray, self.small_size, dst=self.small, interpolation=cv.INTER_AREA)
+        previous = self.buffers[self.current]
+        self.current ^= 1
+        np.copyto(self.buffers[self.current], self.small)
+        if not self.primed:
+            self.primed = True
+            return None, 0.0
+        (dx, dy), response = cv.phaseCorrelate(previous, self.buffers[self.current], self.window)
+        return np.array([dx / self.scale, dy / self.scale]), float(response)
+
+    def estimate(self, gray):
+        shift, response = self.correlate(gray)
+        if shift is None or response < self.MIN_RESPONSE:
+            return None, response
+        return shift, response
+
+# phase correlation on a small frame for the coarse motion, then lucas kanade
+# on the full frame starting from it, so no pyramid has to be searched. when
+# the corners can't be followed the coarse motion is used on its own
+class HybridTracker(MotionTracker):
+    def __init__(self, size, scale=0.25):
+        super().__init__(size)
+        self.coarse = PhaseCorrelationTracker(size, scale)
+        self.fine = LKTracker(size, dict(LK_PARAMS, maxLevel=0))
+
+    def estimate(self, gray):
+        shift, response = self.coarse.correlate(gray)
+        guess = shift if shift is not None and response >= PhaseCorrelationTracker.MIN_RESPONSE else None
+        motion, confidence = self.fine.estimate(gray, guess)
+        if motion is not None and confidence >= 0.5:
+            return motion, max(confidence, response)
+        if guess is not None:
+            return guess, response
+        return motion, confidence
+
+ENGINES = {
+    "lk": LKTracker,
+    "phase": PhaseCorrelationTracker,
+    "hybrid": HybridTracker,
+}
+
+def make_tracker(engine, size):
+    return ENGINES[engine](size)
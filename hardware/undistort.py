@@ -3,18 +3,61 @@
 import numpy as np
 import sys
 import cv2 as cv2
+from functools import lru_cache
 
 DIM=(640, 480)
 K=np.array([[359.8891228256634, 0.0, 335.1625120488727], [0.0, 359.7463655695599, 220.7128714747221], [0.0, 0.0, 1.0]])
 D=np.array([[-0.01684524332140226], [-0.08959331600156382], [0.31754669583708056], [-0.42204012028321364]])
-def undistort(img):
+
+# remap tables for a (width, height) frame, built once per resolution.
+# K was calibrated at DIM so it is scaled to other sizes of the same sensor mode
+@lru_cache(maxsize=4)
+def undistort_maps(size):
+    width, height = size
+    scaled_K = K.copy()
+    scaled_K[0] *= width / DIM[0]
+    scaled_K[1] *= height / DIM[1]
+    # fixed point maps, remap is faster with these than with float ones
+    return cv2.fisheye.initUndistortRectifyMap(scaled_K, D, np.eye(3), scaled_K, size, cv2.CV_16SC2)
+
+def undistort(img, out=None):
     h,w = img.shape[:2]
-    map1, map2 = cv2.fisheye.initUndistortRectifyMap(K, D, np.eye(3), K, DIM, cv2.CV_16SC2)
-    undistorted_img = cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
-    # cv2.imshow("undistorted", undistorted_img)
-    # cv2.waitKey(0)
-    # cv2.destroyAllWindows()
-    return undistorted_img
+    map1, map2 = undistort_maps((w, h))
+    return cv2.remap(img, map1, map2, dst=out, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+
+# turns camera frames into (optionally undistorted) grayscale for tracking.
+# converting to gray first means remap only moves one channel instead of
+# three, and results go into two preallocated buffers that take turns, so
+# the previous frame stays valid while the next one is written and nothing
+# is allocated per frame
+class GrayFrames:
+    def __init__(self, size, undistort=True):
+        width, height = size
+        self.maps = undistort_maps((width, height)) if undistort else None
+        self.scratch = np.empty((height, width), dtype=np.uint8)
+        self.buffers = [np.empty((height, width), dtype=np.uint8) for _ in range(2)]
+        self.current = 0
+
+    # gray version of frame, valid until the call after next
+    def next(self, frame):
+        self.current ^= 1
+        return self.convert(frame, self.buffers[self.current])
+
+    # write the gray version of frame into out, a preallocated (height, width) array
+    def convert(self, frame, out):
+        # already single channel (the Y plane of a YUV frame) needs no conversion
+        if frame.ndim == 2:
+            gray = frame
+        else:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.scratch if self.maps is not None else out)
+        if self.maps is None:
+            if gray is not out:
+                np.copyto(out, gray)
+            return out
+        cv2.remap(gray, self.maps[0], self.maps[1], dst=out, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        return out
+
 if __name__ == '__main__':
     for p in sys.argv[1:]:
-        undistort(p)
+        name, _, ext = p.rpartition('.')
+        cv2.imwrite(f"{name}_undistorted.{ext}", undistort(cv2.imread(p)))